@@ -0,0 +1,72 @@
+"""Import-time budget check for the openvoice package, based on `python -X importtime`.
+
+Every module is imported in a fresh interpreter after torch and numpy, which every
+entry point needs anyway, so the reported time is what openvoice itself adds.
+The check fails if a module exceeds its budget or pulls in a heavy optional
+dependency at import time.
+
+    python bench_import.py
+    python bench_import.py --show 10   # also list the 10 slowest nested imports
+"""
+import re
+import sys
+import argparse
+import subprocess
+
+# cumulative import time budget in milliseconds, on top of torch + numpy
+BUDGETS_MS = {
+    'openvoice.api': 150,
+    'openvoice.se_extractor': 100,
+    'openvoice.mel_processing': 50,
+    'openvoice.utils': 50,
+}
+
+# must only be imported when the feature that needs them is first used
+HEAVY_MODULES = [
+    'librosa', 'soundfile', 'faster_whisper', 'pydub', 'whisper_timestamped', 'wavmark',
+    'inflect', 'eng_to_ipa', 'unidecode', 'jieba', 'pypinyin', 'cn2an',
+]
+
+_line_re = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def measure(module):
+    """Return [(cumulative_us, depth, name)] for every module imported by `module`."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import torch, numpy; import {module}'],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f'importing {module} failed:\n{proc.stderr}')
+    # torch and numpy are imported first; only keep what the target import added
+    lines = proc.stderr.splitlines()
+    start = max(i for i, line in enumerate(lines) if line.endswith(('| torch', '| numpy'))) + 1
+    entries = []
+    for line in lines[start:]:
+        m = _line_re.match(line)
+        if m:
+            entries.append((int(m.group(2)), len(m.group(3)) // 2, m.group(4)))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--show', type=int, default=0, help="print the N slowest nested imports")
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget_ms in BUDGETS_MS.items():
+        entries = measure(module)
+        total_ms = next(us for us, _, name in entries if name == module) / 1000
+        heavy = sorted({name.split('.')[0] for _, _, name in entries} & set(HEAVY_MODULES))
+        ok = total_ms <= budget_ms and len(heavy) == 0
+        failed = failed or not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {module}: {total_ms:.1f} ms (budget {budget_ms} ms)"
+              + (f", heavy imports: {', '.join(heavy)}" if heavy else ''))
+        for us, depth, name in sorted(entries, reverse=True)[1:args.show + 1]:
+            print(f'       {us / 1000:8.1f} ms  {name}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ import torch
 from typing import Optional, Dict, Tuple
 from openvoice import se_extractor
 from openvoice.api import ToneColorConverter
+from openvoice.se_store import SpeakerEmbeddingStore, nearest_base_speakers
+from openvoice.pipeline import OpenVoicePipeline
+from openvoice.wav_writer import WavWriter
 from melo.api import TTS
 from icecream import ic
 
@@ -13,10 +16,12 @@ class OpenVoiceTTS:
         self,
         reference_speaker: str = "resources/voice_female1.mp3",
         speed: float = 1.0,
+        top_k: int = 1,
         output_dir: str = "/Users/bub/Desktop/APPS/ERU_general/eru/backend/server/audio_management/audio_transcriptions",
     ):
         self.reference_speaker = reference_speaker
         self.speed = speed
+        self.top_k = top_k
         self.ckpt_converter = "checkpoints_v2/converter"
         self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
         self.output_dir = output_dir
@@ -33,65 +38,73 @@ class OpenVoiceTTS:
 
     def _initialize_models(self) -> None:
         self.tone_color_converter = ToneColorConverter(
-            f"{self.ckpt_converter}/config.json", device=self.device
+            f"{self.ckpt_converter}/config.json", device=self.device, deferred_init=True
         )
         self.tone_color_converter.load_ckpt(f"{self.ckpt_converter}/checkpoint.pth")
         self.target_se, _ = se_extractor.get_se(
-            self.reference_speaker, self.tone_color_converter, vad=False
+            self.reference_speaker, self.tone_color_converter, segmentation="silero"
         )
         self.model = TTS(language="EN_NEWEST", device=self.device)
         self.speaker_ids = self.model.hps.data.spk2id
         ic("Available speaker IDs:", self.speaker_ids)
 
+        # the target voice is fixed, so the closest base speakers are picked once
+        self.base_se_store = SpeakerEmbeddingStore()
+        self.base_se_store.import_se_files("checkpoints_v2/base_speakers/ses/*.pth")
+        self.base_speakers = nearest_base_speakers(
+            self.base_se_store, self.target_se, self.speaker_ids, k=self.top_k
+        )
+        ic("Nearest base speakers:", self.base_speakers)
+
     def generate_audio(self, input_text: str, file_name: str) -> Optional[str]:
-        src_path = os.path.join(self.output_dir, "tmp.wav")
         out_path = os.path.join(self.output_dir, file_name)
 
-        for speaker_key, speaker_id in self.speaker_ids.items():
+        # try the nearest base speakers in order, falling back to the next one on failure
+        for speaker_key, speaker_id, _ in self.base_speakers:
             ic("Processing speaker", speaker_key)
             speaker_key = speaker_key.lower().replace("_", "-")
             source_se = self._load_source_se(speaker_key)
             if source_se is None:
                 continue
 
-            if not self._generate_tts(input_text, speaker_id, src_path):
+            pipeline = OpenVoicePipeline(
+                self.model,
+                self.tone_color_converter,
+                source_se,
+                self.target_se,
+                speaker=speaker_id,
+                message="@MyShell",
+            )
+            source_audio = self._generate_tts(pipeline, input_text)
+            if source_audio is None:
                 continue
 
-            if self._convert_tone_color(src_path, source_se, out_path):
+            if self._convert_tone_color(pipeline, source_audio, out_path):
                 return out_path
 
         return None
 
     def _load_source_se(self, speaker_key: str) -> Optional[torch.Tensor]:
         try:
-            return torch.load(
-                f"checkpoints_v2/base_speakers/ses/{speaker_key}.pth",
-                map_location=self.device,
-            )
-        except FileNotFoundError:
-            ic("Speaker embedding file not found", speaker_key)
+            return self.base_se_store.get_se(speaker_key, self.device)
+        except KeyError:
+            ic("Speaker embedding not found", speaker_key)
             return None
 
-    def _generate_tts(self, input_text: str, speaker_id: int, src_path: str) -> bool:
+    def _generate_tts(self, pipeline: OpenVoicePipeline, input_text: str):
         try:
-            self.model.tts_to_file(input_text, speaker_id, src_path, speed=self.speed)
-            return True
+            return pipeline.synthesize(input_text, speed=self.speed)
         except Exception as e:
             ic("Error generating audio", str(e))
-            return False
+            return None
 
     def _convert_tone_color(
-        self, src_path: str, source_se: torch.Tensor, out_path: str
+        self, pipeline: OpenVoicePipeline, source_audio, out_path: str
     ) -> bool:
         try:
-            encode_message = "@MyShell"
-            self.tone_color_converter.convert(
-                audio_src_path=src_path,
-                src_se=source_se,
-                tgt_se=self.target_se,
-                output_path=out_path,
-                message=encode_message,
-            )
+            audio = pipeline.convert(source_audio)
+            with WavWriter(out_path, pipeline.sampling_rate) as writer:
+                writer.write(audio)
             ic("Audio conversion successful")
             return True
         except Exception as e:
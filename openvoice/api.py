@@ -1,42 +1,92 @@
+import copy
+import inspect
+import contextlib
 import torch
 import numpy as np
 import re
-import soundfile
+import pickle
+import threading
 from openvoice import utils
 from openvoice import commons
 import os
-import librosa
 from openvoice.text import text_to_sequence
-from openvoice.mel_processing import spectrogram_torch
+from openvoice.mel_processing import spectrogram_backends
 from openvoice.models import SynthesizerTrn
+from openvoice.wav_writer import WavWriter
 
 
 class OpenVoiceBaseClass(object):
     def __init__(self, 
                 config_path, 
-                device='cuda:0'):
+                device='cuda:0',
+                deferred_init=False):
         if 'cuda' in device:
             assert torch.cuda.is_available()
 
         hps = utils.get_hparams_from_file(config_path)
 
-        model = SynthesizerTrn(
-            len(getattr(hps, 'symbols', [])),
-            hps.data.filter_length // 2 + 1,
-            n_speakers=hps.data.n_speakers,
-            **hps.model,
-        ).to(device)
+        with commons.skip_init() if deferred_init else contextlib.nullcontext():
+            # with deferred_init the random init is skipped, load_ckpt assigns the real tensors
+            model = SynthesizerTrn(
+                len(getattr(hps, 'symbols', [])),
+                hps.data.filter_length // 2 + 1,
+                n_speakers=hps.data.n_speakers,
+                **hps.model,
+            ).to(device)
 
         model.eval()
         self.model = model
         self.hps = hps
         self.device = device
+        self.deferred_init = deferred_init
 
     def load_ckpt(self, ckpt_path):
-        checkpoint_dict = torch.load(ckpt_path, map_location=torch.device(self.device))
-        a, b = self.model.load_state_dict(checkpoint_dict['model'], strict=False)
+        own_keys = set(self.model.state_dict().keys())
+        state_dict, pruned = load_state_dict(ckpt_path, self.device, keys=own_keys)
+        kwargs = {}
+        if self.deferred_init and 'assign' in inspect.signature(self.model.load_state_dict).parameters:
+            # torch >= 2.1: adopt the loaded tensors instead of copying them into the uninitialized ones
+            kwargs['assign'] = True
+        a, b = self.model.load_state_dict(state_dict, strict=False, **kwargs)
         print("Loaded checkpoint '{}'".format(ckpt_path))
         print('missing/unexpected keys:', a, b)
+        if len(pruned) > 0:
+            print(f'skipped {len(pruned)} checkpoint keys not used by this model')
+        if self.deferred_init:
+            # these tensors were never initialized, zero-fill them
+            tensors = self.model.state_dict(keep_vars=True)
+            with torch.no_grad():
+                for name in a:
+                    print(f'{name} not in checkpoint, initialized with zeros')
+                    tensors[name].zero_()
+
+
+def load_state_dict(ckpt_path, device, keys=None):
+    """Load the model state dict of a `.pth` or `.safetensors` checkpoint.
+
+    Only tensors whose name is in `keys` (all if None) are read and moved to `device`.
+    `.pth` files are memory-mapped when torch supports it, so pruned tensors are never
+    read from disk; `.safetensors` files are read tensor by tensor.
+
+    Returns:
+        (state_dict, pruned): the loaded tensors and the names that were skipped.
+    """
+    if ckpt_path.endswith('.safetensors'):
+        from safetensors import safe_open
+        with safe_open(ckpt_path, framework='pt', device='cpu') as f:
+            names = list(f.keys())
+            state_dict = {k: f.get_tensor(k).to(device) for k in names if keys is None or k in keys}
+        return state_dict, [k for k in names if k not in state_dict]
+
+    try:
+        checkpoint_dict = torch.load(ckpt_path, map_location='cpu', mmap=True, weights_only=True)
+    except (TypeError, RuntimeError, pickle.UnpicklingError):
+        # torch < 2.1, legacy (non-zip) checkpoints, or pickles holding more than tensors
+        checkpoint_dict = torch.load(ckpt_path, map_location='cpu')
+    state_dict = checkpoint_dict.get('model', checkpoint_dict)
+    pruned = [k for k in state_dict if keys is not None and k not in keys]
+    state_dict = {k: v.to(device) for k, v in state_dict.items() if keys is None or k in keys}
+    return state_dict, pruned
 
 
 class BaseSpeakerTTS(OpenVoiceBaseClass):
@@ -54,13 +104,36 @@ class BaseSpeakerTTS(OpenVoiceBaseClass):
         return text_norm
 
     @staticmethod
-    def audio_numpy_concat(segment_data_list, sr, speed=1.):
-        audio_segments = []
+    def get_text_batch(texts, hps, is_symbol):
+        """Batched `get_text`: returns padded ids [b, t] and their lengths [b] for `model.infer`."""
+        cleaner_names = [] if is_symbol else hps.data.text_cleaners
+        seqs = [text_to_sequence(text, hps.symbols, cleaner_names) for text in texts]
+        return commons.intersperse_batch(seqs, 0, add_blank=hps.data.add_blank)
+
+    @staticmethod
+    def audio_numpy_concat(segment_data_list, sr, speed=1., out=None, mmap_path=None):
+        """Concatenate segments, each followed by 0.05s of silence, into one float32 buffer.
+
+        The buffer is allocated once. Pass `out` to fill a preallocated array (a view
+        of its first `total_len` samples is returned), or `mmap_path` to assemble very
+        long renders in a memory-mapped raw float32 file.
+        """
+        n_silence = int((sr * 0.05)/speed)
+        total_len = sum(segment_data.size + n_silence for segment_data in segment_data_list)
+        if out is None:
+            if mmap_path is not None and total_len > 0:
+                out = np.memmap(mmap_path, dtype=np.float32, mode='w+', shape=(total_len,))
+            else:
+                out = np.zeros(total_len, dtype=np.float32)
+        assert len(out) >= total_len, f"output buffer too small: {len(out)} < {total_len}"
+
+        pos = 0
         for segment_data in segment_data_list:
-            audio_segments += segment_data.reshape(-1).tolist()
-            audio_segments += [0] * int((sr * 0.05)/speed)
-        audio_segments = np.array(audio_segments).astype(np.float32)
-        return audio_segments
+            n = segment_data.size
+            out[pos:pos + n] = segment_data.reshape(-1)
+            out[pos + n:pos + n + n_silence] = 0
+            pos += n + n_silence
+        return out[:total_len]
 
     @staticmethod
     def split_sentences_into_pieces(text, language_str):
@@ -70,49 +143,133 @@ class BaseSpeakerTTS(OpenVoiceBaseClass):
         print(" > ===========================")
         return texts
 
-    def tts(self, text, output_path, speaker, language='English', speed=1.0):
+    def _tts_sentence(self, t, mark, speaker_id, speed, return_tensor=False):
+        t = re.sub(r'([a-z])([A-Z])', r'\1 \2', t)
+        t = f'[{mark}]{t}[{mark}]'
+        stn_tst = self.get_text(t, self.hps, False)
+        device = self.device
+        with torch.no_grad():
+            x_tst = stn_tst.unsqueeze(0).to(device)
+            x_tst_lengths = torch.LongTensor([stn_tst.size(0)]).to(device)
+            sid = torch.LongTensor([speaker_id]).to(device)
+            audio = self.model.infer(x_tst, x_tst_lengths, sid=sid, noise_scale=0.667, noise_scale_w=0.6,
+                                length_scale=1.0 / speed)[0][0, 0].data.float()
+        if return_tensor:
+            return audio
+        return audio.cpu().numpy()
+
+    def tts(self, text, output_path, speaker, language='English', speed=1.0, return_tensor=False):
+        """Synthesize `text` to `output_path`, or return float32 audio when it is None.
+
+        With `return_tensor`, the audio is returned as a tensor on the model's device
+        instead of a numpy buffer, so it can be handed to the converter without a copy.
+        """
         mark = self.language_marks.get(language.lower(), None)
         assert mark is not None, f"language {language} is not supported"
 
         texts = self.split_sentences_into_pieces(text, mark)
+        speaker_id = self.hps.speakers[speaker]
+
+        if output_path is not None:
+            # stream every sentence to disk as soon as it is synthesized
+            sr = self.hps.data.sampling_rate
+            silence = np.zeros(int((sr * 0.05) / speed), dtype=np.float32)
+            with WavWriter(output_path, sr) as writer:
+                for t in texts:
+                    writer.write(self._tts_sentence(t, mark, speaker_id, speed))
+                    writer.write(silence)
+            return
+
+        if return_tensor:
+            silence = torch.zeros(int((self.hps.data.sampling_rate * 0.05) / speed), device=self.device)
+            pieces = []
+            for t in texts:
+                pieces += [self._tts_sentence(t, mark, speaker_id, speed, return_tensor=True), silence]
+            return torch.cat(pieces) if len(pieces) > 0 else silence[:0]
 
         audio_list = []
         for t in texts:
-            t = re.sub(r'([a-z])([A-Z])', r'\1 \2', t)
-            t = f'[{mark}]{t}[{mark}]'
-            stn_tst = self.get_text(t, self.hps, False)
-            device = self.device
-            speaker_id = self.hps.speakers[speaker]
-            with torch.no_grad():
-                x_tst = stn_tst.unsqueeze(0).to(device)
-                x_tst_lengths = torch.LongTensor([stn_tst.size(0)]).to(device)
-                sid = torch.LongTensor([speaker_id]).to(device)
-                audio = self.model.infer(x_tst, x_tst_lengths, sid=sid, noise_scale=0.667, noise_scale_w=0.6,
-                                    length_scale=1.0 / speed)[0][0, 0].data.cpu().float().numpy()
-            audio_list.append(audio)
+            audio_list.append(self._tts_sentence(t, mark, speaker_id, speed))
         audio = self.audio_numpy_concat(audio_list, sr=self.hps.data.sampling_rate, speed=speed)
+        return audio
 
-        if output_path is None:
-            return audio
-        else:
-            soundfile.write(output_path, audio, self.hps.data.sampling_rate)
+    def tts_stream(self, text_stream, speaker, language='English', speed=1.0, max_in_flight=4):
+        """Synthesize text that is still being generated, one sentence at a time.
+
+        `text_stream` is an iterable of text deltas (e.g. LLM tokens). It is consumed
+        on a background thread, so sentence k is synthesized while sentence k+1 is
+        still being generated; at most `max_in_flight` split sentences wait there.
+        Yields float32 audio per sentence, each followed by the same inter-sentence
+        silence `tts` inserts.
+        """
+        mark = self.language_marks.get(language.lower(), None)
+        assert mark is not None, f"language {language} is not supported"
+        speaker_id = self.hps.speakers[speaker]
+        silence = np.zeros(int((self.hps.data.sampling_rate * 0.05) / speed), dtype=np.float32)
+
+        def synthesize(sentence):
+            audio = self._tts_sentence(sentence, mark, speaker_id, speed)
+            return np.concatenate([audio.astype(np.float32), silence])
+
+        # splitting runs on the producer thread, synthesis on the caller's
+        stages = utils.pipelined_stages(utils.stream_sentences(text_stream, mark), lambda sentence: sentence,
+                                        synthesize, max_in_flight=max_in_flight)
+        try:
+            for audio in stages:
+                yield audio
+        finally:
+            stages.close()
+
+
+_watermark_models = {}
+_watermark_lock = threading.Lock()
+
+
+def get_watermark_model(device):
+    """Process-wide wavmark registry: the model is loaded once and copied once per device."""
+    device = str(device)
+    with _watermark_lock:
+        if device not in _watermark_models:
+            if 'cpu' not in _watermark_models:
+                import wavmark
+                _watermark_models['cpu'] = wavmark.load_model().eval()
+            model = _watermark_models['cpu']
+            if device != 'cpu':
+                model = copy.deepcopy(model).to(device)
+            _watermark_models[device] = model
+        return _watermark_models[device]
 
 
 class ToneColorConverter(OpenVoiceBaseClass):
     def __init__(self, *args, **kwargs):
+        enable_watermark = kwargs.pop('enable_watermark', True)
+        # 'torch' (torch.stft) or 'conv' (conv1d with a cached DFT basis, traceable/exportable)
+        stft_backend = kwargs.pop('stft_backend', 'torch')
+        assert stft_backend in spectrogram_backends, f"unknown stft_backend {stft_backend}"
         super().__init__(*args, **kwargs)
 
-        if kwargs.get('enable_watermark', True):
-            import wavmark
-            self.watermark_model = wavmark.load_model().to(self.device)
-        else:
-            self.watermark_model = None
+        self.spectrogram = spectrogram_backends[stft_backend]
+
+        # the watermark model is only loaded on first add_watermark / detect_watermark
+        self.enable_watermark = enable_watermark
+        self._watermark_model = None
         self.version = getattr(self.hps, '_version_', "v1")
 
+    @property
+    def watermark_model(self):
+        if self._watermark_model is None and self.enable_watermark:
+            self._watermark_model = get_watermark_model(self.device)
+        return self._watermark_model
+
+    @watermark_model.setter
+    def watermark_model(self, model):
+        self._watermark_model = model
+        self.enable_watermark = model is not None
 
 
     def extract_se(self, ref_wav_list, se_save_path=None):
-        if isinstance(ref_wav_list, str):
+        """`ref_wav_list` holds file paths and/or float buffers already at hps.data.sampling_rate."""
+        if isinstance(ref_wav_list, (str, np.ndarray)):
             ref_wav_list = [ref_wav_list]
         
         device = self.device
@@ -120,11 +277,15 @@ class ToneColorConverter(OpenVoiceBaseClass):
         gs = []
         
         for fname in ref_wav_list:
-            audio_ref, sr = librosa.load(fname, sr=hps.data.sampling_rate)
+            if isinstance(fname, str):
+                import librosa
+                audio_ref, sr = librosa.load(fname, sr=hps.data.sampling_rate)
+            else:
+                audio_ref = fname
             y = torch.FloatTensor(audio_ref)
             y = y.to(device)
             y = y.unsqueeze(0)
-            y = spectrogram_torch(y, hps.data.filter_length,
+            y = self.spectrogram(y, hps.data.filter_length,
                                         hps.data.sampling_rate, hps.data.hop_length, hps.data.win_length,
                                         center=False).to(device)
             with torch.no_grad():
@@ -138,65 +299,144 @@ class ToneColorConverter(OpenVoiceBaseClass):
 
         return gs
 
-    def convert(self, audio_src_path, src_se, tgt_se, output_path=None, tau=0.3, message="default"):
+    def encode_source(self, audio_src, src_se, tau=0.3):
+        """Compute the target-independent latent of a source utterance once.
+
+        `audio_src` is a file path, or a float numpy buffer or tensor (possibly already
+        on the model's device) at hps.data.sampling_rate.
+        Returns (z_p, y_mask), to be rendered with `decode_target`.
+        """
         hps = self.hps
-        # load audio
-        audio, sample_rate = librosa.load(audio_src_path, sr=hps.data.sampling_rate)
-        audio = torch.tensor(audio).float()
-        
+        if isinstance(audio_src, str):
+            import librosa
+            audio_src, sample_rate = librosa.load(audio_src, sr=hps.data.sampling_rate)
+
         with torch.no_grad():
-            y = torch.FloatTensor(audio).to(self.device)
+            if isinstance(audio_src, torch.Tensor):
+                y = audio_src.float().reshape(-1).to(self.device)
+            else:
+                y = torch.FloatTensor(audio_src).to(self.device)
             y = y.unsqueeze(0)
-            spec = spectrogram_torch(y, hps.data.filter_length,
+            spec = self.spectrogram(y, hps.data.filter_length,
                                     hps.data.sampling_rate, hps.data.hop_length, hps.data.win_length,
                                     center=False).to(self.device)
             spec_lengths = torch.LongTensor([spec.size(-1)]).to(self.device)
-            audio = self.model.voice_conversion(spec, spec_lengths, sid_src=src_se, sid_tgt=tgt_se, tau=tau)[0][
+            z, z_p, y_mask = self.model.voice_conversion_encode(spec, spec_lengths, sid_src=src_se, tau=tau)
+        return z_p, y_mask
+
+    def decode_target(self, z_p, y_mask, tgt_se, message="default"):
+        """Render a latent from `encode_source` with the target embedding `tgt_se`."""
+        with torch.no_grad():
+            audio = self.model.voice_conversion_decode(z_p, y_mask, sid_tgt=tgt_se)[0][
                         0, 0].data.cpu().float().numpy()
-            audio = self.add_watermark(audio, message)
-            if output_path is None:
-                return audio
-            else:
-                soundfile.write(output_path, audio, hps.data.sampling_rate)
-    
-    def add_watermark(self, audio, message):
+        return self.add_watermark(audio, message)
+
+    def convert(self, audio_src_path, src_se, tgt_se, output_path=None, tau=0.3, message="default"):
+        z_p, y_mask = self.encode_source(audio_src_path, src_se, tau=tau)
+        audio = self.decode_target(z_p, y_mask, tgt_se, message=message)
+        if output_path is None:
+            return audio
+        else:
+            import soundfile
+            soundfile.write(output_path, audio, self.hps.data.sampling_rate)
+
+    def decode_targets(self, z_p, y_mask, tgt_ses, message="default"):
+        """Render one source latent with several targets in a single batched forward."""
+        n = len(tgt_ses)
+        g_tgt = torch.cat([tgt_se.to(self.device) for tgt_se in tgt_ses], dim=0)
+        with torch.no_grad():
+            o_hat = self.model.voice_conversion_decode(z_p.expand(n, -1, -1), y_mask.expand(n, -1, -1), sid_tgt=g_tgt)[0]
+            audios = o_hat[:, 0].data.cpu().float().numpy()
+        return [self.add_watermark(audio, message) for audio in audios]
+
+    def convert_many_targets(self, audio_src_path, src_se, tgt_ses, output_paths=None, tau=0.3, message="default",
+                             batch_size=8):
+        """Convert one source to several target voices, `batch_size` targets per forward.
+
+        The source latent is tiled across the batch, so the reverse flow and decoder run
+        once per batch with a different target embedding per item. Returns the list of
+        audios, or writes them to `output_paths` (one per target).
+        """
+        assert output_paths is None or len(output_paths) == len(tgt_ses)
+        z_p, y_mask = self.encode_source(audio_src_path, src_se, tau=tau)
+        audios = []
+        for i in range(0, len(tgt_ses), batch_size):
+            audios.extend(self.decode_targets(z_p, y_mask, tgt_ses[i: i + batch_size], message=message))
+        if output_paths is None:
+            return audios
+        import soundfile
+        for audio, output_path in zip(audios, output_paths):
+            soundfile.write(output_path, audio, self.hps.data.sampling_rate)
+
+    def convert_one_to_many(self, audio_src_path, src_se, tgt_ses, output_paths=None, tau=0.3, message="default",
+                            batch_size=1):
+        """`convert_many_targets` decoding one target at a time by default."""
+        return self.convert_many_targets(audio_src_path, src_se, tgt_ses, output_paths=output_paths, tau=tau,
+                                         message=message, batch_size=batch_size)
+
+    @staticmethod
+    def watermark_windows(n_samples, n_repeat, K=16000, coeff=2):
+        """Sample indices [n, K] of the watermark windows that fit in `n_samples`, n <= n_repeat."""
+        n_fit = (n_samples - K) // (coeff * K) + 1 if n_samples >= K else 0
+        n_windows = min(n_repeat, n_fit)
+        starts = np.arange(n_windows) * (coeff * K)
+        return starts[:, None] + np.arange(K)[None]
+
+    def add_watermark(self, audio, message, batch_size=None):
         if self.watermark_model is None:
             return audio
         device = self.device
         bits = utils.string_to_bits(message).reshape(-1)
         n_repeat = len(bits) // 32
 
-        K = 16000
-        coeff = 2
-        for n in range(n_repeat):
-            trunck = audio[(coeff * n) * K: (coeff * n + 1) * K]
-            if len(trunck) != K:
-                print('Audio too short, fail to add watermark')
-                break
-            message_npy = bits[n * 32: (n + 1) * 32]
-            
+        # embed every 32-bit block in one batched encode instead of one call per block
+        index = self.watermark_windows(len(audio), n_repeat)
+        n_windows = len(index)
+        if n_windows < n_repeat:
+            print('Audio too short, fail to add watermark')
+        if n_windows == 0:
+            return audio
+        batch_size = batch_size or n_windows
+
+        messages = bits[:n_windows * 32].reshape(n_windows, 32)
+        for i in range(0, n_windows, batch_size):
+            batch_index = index[i: i + batch_size]
             with torch.no_grad():
-                signal = torch.FloatTensor(trunck).to(device)[None]
-                message_tensor = torch.FloatTensor(message_npy).to(device)[None]
+                signal = torch.FloatTensor(audio[batch_index]).to(device)
+                message_tensor = torch.FloatTensor(messages[i: i + batch_size]).to(device)
                 signal_wmd_tensor = self.watermark_model.encode(signal, message_tensor)
-                signal_wmd_npy = signal_wmd_tensor.detach().cpu().squeeze()
-            audio[(coeff * n) * K: (coeff * n + 1) * K] = signal_wmd_npy
+                signal_wmd_npy = signal_wmd_tensor.detach().cpu().numpy()
+            audio[batch_index] = signal_wmd_npy
         return audio
 
     def detect_watermark(self, audio, n_repeat):
-        bits = []
-        K = 16000
-        coeff = 2
-        for n in range(n_repeat):
-            trunck = audio[(coeff * n) * K: (coeff * n + 1) * K]
-            if len(trunck) != K:
+        return self.detect_watermark_batch([audio], n_repeat)[0]
+
+    def detect_watermark_batch(self, audio_list, n_repeat, batch_size=None):
+        """Decode the watermark of several clips with one batched decode over all their windows.
+
+        Returns one message per clip, or 'Fail' for clips too short to hold `n_repeat` blocks.
+        """
+        windows = []
+        for audio in audio_list:
+            index = self.watermark_windows(len(audio), n_repeat)
+            if len(index) < n_repeat:
                 print('Audio too short, fail to detect watermark')
-                return 'Fail'
+                windows.append(None)
+            else:
+                windows.append(audio[index])
+        valid = [w for w in windows if w is not None]
+        if len(valid) == 0:
+            return ['Fail'] * len(audio_list)
+
+        signal_npy = np.concatenate(valid, axis=0)
+        batch_size = batch_size or len(signal_npy)
+        bits = []
+        for i in range(0, len(signal_npy), batch_size):
             with torch.no_grad():
-                signal = torch.FloatTensor(trunck).to(self.device).unsqueeze(0)
-                message_decoded_npy = (self.watermark_model.decode(signal) >= 0.5).int().detach().cpu().numpy().squeeze()
-            bits.append(message_decoded_npy)
-        bits = np.stack(bits).reshape(-1, 8)
-        message = utils.bits_to_string(bits)
-        return message
-    
+                signal = torch.FloatTensor(signal_npy[i: i + batch_size]).to(self.device)
+                bits.append((self.watermark_model.decode(signal) >= 0.5).int().detach().cpu().numpy())
+        bits = np.concatenate(bits, axis=0).reshape(len(valid), -1, 8)
+
+        messages = iter(utils.bits_to_strings(bits))
+        return ['Fail' if w is None else next(messages) for w in windows]
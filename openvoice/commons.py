@@ -1,12 +1,53 @@
 import math
+import functools
+import threading
+import contextlib
 import torch
+from torch import nn
 from torch.nn import functional as F
 
 
 def init_weights(m, mean=0.0, std=0.01):
     classname = m.__class__.__name__
     if classname.find("Conv") != -1:
-        m.weight.data.normal_(mean, std)
+        nn.init.normal_(m.weight, mean, std)
+
+
+_init_fns = ['uniform_', 'normal_', 'trunc_normal_', 'constant_', 'ones_', 'zeros_', 'xavier_uniform_',
+             'xavier_normal_', 'kaiming_uniform_', 'kaiming_normal_', 'orthogonal_']
+_skip_init_state = threading.local()
+_skip_init_lock = threading.Lock()
+
+
+def _skippable(fn):
+    @functools.wraps(fn)
+    def wrapper(tensor, *args, **kwargs):
+        if getattr(_skip_init_state, 'active', False):
+            return tensor
+        return fn(tensor, *args, **kwargs)
+    wrapper._skippable = True
+    return wrapper
+
+
+@contextlib.contextmanager
+def skip_init():
+    """Turn torch.nn.init functions into no-ops on the calling thread, e.g. while building
+    a model whose weights are about to be replaced by a checkpoint.
+
+    The functions are wrapped once with a thread-local switch, so modules built on other
+    threads at the same time are initialized normally.
+    """
+    with _skip_init_lock:
+        for name in _init_fns:
+            fn = getattr(nn.init, name, None)
+            if fn is not None and not getattr(fn, '_skippable', False):
+                setattr(nn.init, name, _skippable(fn))
+    active = getattr(_skip_init_state, 'active', False)
+    _skip_init_state.active = True
+    try:
+        yield
+    finally:
+        _skip_init_state.active = active
 
 
 def get_padding(kernel_size, dilation=1):
@@ -25,6 +66,22 @@ def intersperse(lst, item):
     return result
 
 
+def intersperse_batch(seqs, item=0, add_blank=True):
+    """Pad a list of id sequences into one LongTensor, optionally interspersing `item`.
+
+    Returns:
+        x: [b, t] ids, padded with `item`
+        x_lengths: [b] valid length of every row
+    """
+    step = 2 if add_blank else 1
+    x_lengths = torch.LongTensor([len(s) * step + int(add_blank) for s in seqs])
+    max_len = int(x_lengths.max()) if len(seqs) > 0 else 0
+    x = torch.full((len(seqs), max_len), item, dtype=torch.long)
+    for i, s in enumerate(seqs):
+        x[i, int(add_blank):len(s) * step:step] = torch.as_tensor(s, dtype=torch.long)
+    return x, x_lengths
+
+
 def kl_divergence(m_p, logs_p, m_q, logs_q):
     """KL(P||Q)"""
     kl = (logs_q - logs_p) - 0.5
@@ -0,0 +1,42 @@
+"""Offline checkpoint conversion: keep only the tensors the model owns and save them as
+safetensors (or a pruned `.pth`), so workers start from a smaller, mmap-friendly file.
+
+    python -m openvoice.convert_ckpt --config checkpoints_v2/converter/config.json \
+        --ckpt checkpoints_v2/converter/checkpoint.pth \
+        --output checkpoints_v2/converter/checkpoint.safetensors
+"""
+import argparse
+import torch
+from openvoice import utils
+from openvoice.api import load_state_dict
+from openvoice.models import SynthesizerTrn
+
+
+def convert_ckpt(config_path, ckpt_path, output_path):
+    hps = utils.get_hparams_from_file(config_path)
+    model = SynthesizerTrn(
+        len(getattr(hps, 'symbols', [])),
+        hps.data.filter_length // 2 + 1,
+        n_speakers=hps.data.n_speakers,
+        **hps.model,
+    )
+    own_keys = set(model.state_dict().keys())
+    state_dict, pruned = load_state_dict(ckpt_path, 'cpu', keys=own_keys)
+    state_dict = {k: v.contiguous() for k, v in state_dict.items()}
+
+    if output_path.endswith('.safetensors'):
+        from safetensors.torch import save_file
+        save_file(state_dict, output_path)
+    else:
+        torch.save({'model': state_dict}, output_path)
+    print(f"Saved {len(state_dict)} tensors to '{output_path}', pruned {len(pruned)} keys")
+    return pruned
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, required=True)
+    parser.add_argument('--ckpt', type=str, required=True)
+    parser.add_argument('--output', type=str, required=True, help="`.safetensors` or `.pth`")
+    args = parser.parse_args()
+    convert_ckpt(args.config, args.ckpt, args.output)
@@ -1,6 +1,6 @@
 import torch
 import torch.utils.data
-from librosa.filters import mel as librosa_mel_fn
+from openvoice.utils import BoundedCache
 
 MAX_WAV_VALUE = 32768.0
 
@@ -33,151 +33,177 @@ def spectral_de_normalize_torch(magnitudes):
     return output
 
 
-mel_basis = {}
-hann_window = {}
+# keyed by (win_size, dtype, device)
+hann_window = BoundedCache()
+# keyed by (sampling_rate, n_fft, num_mels, fmin, fmax, dtype, device)
+mel_basis = BoundedCache()
+# keyed by (n_fft, win_size, dtype, device)
+conv_basis = BoundedCache()
 
 
-def spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=False):
-    if torch.min(y) < -1.1:
-        print("min value is ", torch.min(y))
-    if torch.max(y) > 1.1:
-        print("max value is ", torch.max(y))
+def cache_stats():
+    return dict(hann_window=hann_window.stats(), mel_basis=mel_basis.stats(), conv_basis=conv_basis.stats())
 
-    global hann_window
-    dtype_device = str(y.dtype) + "_" + str(y.device)
-    wnsize_dtype_device = str(win_size) + "_" + dtype_device
-    if wnsize_dtype_device not in hann_window:
-        hann_window[wnsize_dtype_device] = torch.hann_window(win_size).to(
-            dtype=y.dtype, device=y.device
-        )
 
-    y = torch.nn.functional.pad(
-        y.unsqueeze(1),
-        (int((n_fft - hop_size) / 2), int((n_fft - hop_size) / 2)),
-        mode="reflect",
+def get_hann_window(win_size, dtype, device):
+    return hann_window.get_or_create(
+        (win_size, dtype, torch.device(device)),
+        lambda: torch.hann_window(win_size).to(dtype=dtype, device=device),
     )
-    y = y.squeeze(1)
+
+
+def get_mel_basis(sampling_rate, n_fft, num_mels, fmin, fmax, dtype, device):
+    def build():
+        from librosa.filters import mel as librosa_mel_fn
+        mel = librosa_mel_fn(sr=sampling_rate, n_fft=n_fft, n_mels=num_mels, fmin=fmin, fmax=fmax)
+        return torch.from_numpy(mel).to(dtype=dtype, device=device)
+
+    return mel_basis.get_or_create((sampling_rate, n_fft, num_mels, fmin, fmax, dtype, torch.device(device)), build)
+
+
+def _reflect_pad(y, pad, lengths=None):
+    """Reflect-pad [b, t] audio by `pad` on both sides. With `lengths`, each row is
+    padded at its own end, so valid frames match the unbatched result."""
+    if lengths is None:
+        return torch.nn.functional.pad(y.unsqueeze(1), (pad, pad), mode="reflect").squeeze(1)
+    out = y.new_zeros(y.size(0), y.size(1) + 2 * pad)
+    for i, length in enumerate(lengths.tolist()):
+        out[i, :length + 2 * pad] = torch.nn.functional.pad(y[i:i + 1, None, :length], (pad, pad), mode="reflect")[0, 0]
+    return out
+
+
+def spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=False, lengths=None, check_range=False):
+    """Linear magnitude spectrogram [b, n_fft // 2 + 1, frames] of [b, t] audio.
+
+    `lengths` ([b] valid samples per row) enables batched input of different
+    lengths: frames past each row's end are zeroed and (spec, spec_lengths) is
+    returned. `check_range` prints a warning for samples outside [-1.1, 1.1]; it is
+    off by default because it synchronizes with the device.
+    """
+    if check_range:
+        if torch.min(y) < -1.1:
+            print("min value is ", torch.min(y))
+        if torch.max(y) > 1.1:
+            print("max value is ", torch.max(y))
+
+    pad = int((n_fft - hop_size) / 2)
+    y = _reflect_pad(y, pad, lengths)
 
     spec = torch.stft(
         y,
         n_fft,
         hop_length=hop_size,
         win_length=win_size,
-        window=hann_window[wnsize_dtype_device],
+        window=get_hann_window(win_size, y.dtype, y.device),
         center=center,
         pad_mode="reflect",
         normalized=False,
         onesided=True,
-        return_complex=False,
+        return_complex=True,
     )
 
-    spec = torch.sqrt(spec.pow(2).sum(-1) + 1e-6)
-    return spec
+    # same as sqrt(|spec|^2 + 1e-6) on the real/imag pairs of the old return_complex=False path
+    spec = torch.sqrt(spec.real.pow(2) + spec.imag.pow(2) + 1e-6)
+    if lengths is None:
+        return spec
 
+    assert not center, "lengths is only supported with center=False"
+    return _mask_frames(spec, lengths, n_fft, hop_size)
 
-def spectrogram_torch_conv(y, n_fft, sampling_rate, hop_size, win_size, center=False):
-    # if torch.min(y) < -1.:
-    #     print('min value is ', torch.min(y))
-    # if torch.max(y) > 1.:
-    #     print('max value is ', torch.max(y))
 
-    global hann_window
-    dtype_device = str(y.dtype) + '_' + str(y.device)
-    wnsize_dtype_device = str(win_size) + '_' + dtype_device
-    if wnsize_dtype_device not in hann_window:
-        hann_window[wnsize_dtype_device] = torch.hann_window(win_size).to(dtype=y.dtype, device=y.device)
+def _mask_frames(spec, lengths, n_fft, hop_size):
+    pad = int((n_fft - hop_size) / 2)
+    spec_lengths = (lengths + 2 * pad - n_fft) // hop_size + 1
+    mask = torch.arange(spec.size(-1), device=spec.device).unsqueeze(0) < spec_lengths.to(spec.device).unsqueeze(1)
+    return spec * mask.unsqueeze(1).to(spec.dtype), spec_lengths
 
-    y = torch.nn.functional.pad(y.unsqueeze(1), (int((n_fft-hop_size)/2), int((n_fft-hop_size)/2)), mode='reflect')
-    
-    # ******************** original ************************#
-    # y = y.squeeze(1)
-    # spec1 = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=hann_window[wnsize_dtype_device],
-    #                   center=center, pad_mode='reflect', normalized=False, onesided=True, return_complex=False)
 
-    # ******************** ConvSTFT ************************#
-    freq_cutoff = n_fft // 2 + 1
-    fourier_basis = torch.view_as_real(torch.fft.fft(torch.eye(n_fft)))
-    forward_basis = fourier_basis[:freq_cutoff].permute(2, 0, 1).reshape(-1, 1, fourier_basis.shape[1])
-    forward_basis = forward_basis * torch.as_tensor(librosa.util.pad_center(torch.hann_window(win_size), size=n_fft)).float()
+def stft_conv_basis(n_fft, win_size, dtype=torch.float32, device="cpu"):
+    """Windowed one-sided DFT basis [2 * (n_fft // 2 + 1), 1, n_fft] for conv1d, real
+    rows first. Built once per (n_fft, win_size, dtype, device)."""
+    def build():
+        freq_cutoff = n_fft // 2 + 1
+        fourier_basis = torch.view_as_real(torch.fft.fft(torch.eye(n_fft, dtype=torch.float64)))
+        forward_basis = fourier_basis[:freq_cutoff].permute(2, 0, 1).reshape(-1, 1, n_fft)
+        # center the window in the frame, like torch.stft does for win_length < n_fft
+        window = torch.zeros(n_fft, dtype=torch.float64)
+        offset = (n_fft - win_size) // 2
+        window[offset:offset + win_size] = torch.hann_window(win_size, dtype=torch.float64)
+        return (forward_basis * window).to(dtype=dtype, device=device)
+
+    return conv_basis.get_or_create((n_fft, win_size, dtype, torch.device(device)), build)
+
 
-    import torch.nn.functional as F
+def spectrogram_torch_conv(y, n_fft, sampling_rate, hop_size, win_size, center=False, lengths=None, verify=False):
+    """`spectrogram_torch` computed as a strided conv1d with a cached DFT basis.
 
-    # if center:
-    #     signal = F.pad(y[:, None, None, :], (n_fft // 2, n_fft // 2, 0, 0), mode = 'reflect').squeeze(1)
+    Only uses reflect padding, conv1d and elementwise ops, so it traces and exports
+    (e.g. to ONNX) where torch.stft does not. `verify` asserts parity with
+    `spectrogram_torch` (atol 1e-4), at the cost of computing both.
+    """
     assert center is False
 
-    forward_transform_squared = F.conv1d(y, forward_basis.to(y.device), stride = hop_size)
-    spec2 = torch.stack([forward_transform_squared[:, :freq_cutoff, :], forward_transform_squared[:, freq_cutoff:, :]], dim = -1)
+    pad = int((n_fft - hop_size) / 2)
+    y_padded = _reflect_pad(y, pad, lengths)
+    basis = stft_conv_basis(n_fft, win_size, dtype=y.dtype, device=y.device)
+    freq_cutoff = n_fft // 2 + 1
 
+    forward_transform = torch.nn.functional.conv1d(y_padded.unsqueeze(1), basis, stride=hop_size)
+    spec = torch.sqrt(forward_transform[:, :freq_cutoff].pow(2) + forward_transform[:, freq_cutoff:].pow(2) + 1e-6)
+    if lengths is not None:
+        spec, spec_lengths = _mask_frames(spec, lengths, n_fft, hop_size)
 
-    # ******************** Verification ************************#
-    spec1 = torch.stft(y.squeeze(1), n_fft, hop_length=hop_size, win_length=win_size, window=hann_window[wnsize_dtype_device],
-                      center=center, pad_mode='reflect', normalized=False, onesided=True, return_complex=False)
-    assert torch.allclose(spec1, spec2, atol=1e-4)
+    if verify:
+        ref = spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=center, lengths=lengths)
+        ref = ref if lengths is None else ref[0]
+        assert torch.allclose(ref, spec, atol=1e-4), f"conv STFT mismatch, max diff {(ref - spec).abs().max()}"
 
-    spec = torch.sqrt(spec2.pow(2).sum(-1) + 1e-6)
-    return spec
+    return spec if lengths is None else (spec, spec_lengths)
 
 
-def spec_to_mel_torch(spec, n_fft, num_mels, sampling_rate, fmin, fmax):
-    global mel_basis
-    dtype_device = str(spec.dtype) + "_" + str(spec.device)
-    fmax_dtype_device = str(fmax) + "_" + dtype_device
-    if fmax_dtype_device not in mel_basis:
-        mel = librosa_mel_fn(sampling_rate, n_fft, num_mels, fmin, fmax)
-        mel_basis[fmax_dtype_device] = torch.from_numpy(mel).to(
-            dtype=spec.dtype, device=spec.device
-        )
-    spec = torch.matmul(mel_basis[fmax_dtype_device], spec)
-    spec = spectral_normalize_torch(spec)
-    return spec
+class ConvSpectrogram(torch.nn.Module):
+    """Module form of `spectrogram_torch_conv` with the basis as a buffer, for export.
 
+    Example:
+        torch.onnx.export(ConvSpectrogram(1024, 256, 1024), torch.zeros(1, 22050), "spec.onnx",
+                          input_names=["audio"], dynamic_axes={"audio": {0: "batch", 1: "samples"}})
+    """
 
-def mel_spectrogram_torch(
-    y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False
-):
-    if torch.min(y) < -1.0:
-        print("min value is ", torch.min(y))
-    if torch.max(y) > 1.0:
-        print("max value is ", torch.max(y))
-
-    global mel_basis, hann_window
-    dtype_device = str(y.dtype) + "_" + str(y.device)
-    fmax_dtype_device = str(fmax) + "_" + dtype_device
-    wnsize_dtype_device = str(win_size) + "_" + dtype_device
-    if fmax_dtype_device not in mel_basis:
-        mel = librosa_mel_fn(sampling_rate, n_fft, num_mels, fmin, fmax)
-        mel_basis[fmax_dtype_device] = torch.from_numpy(mel).to(
-            dtype=y.dtype, device=y.device
-        )
-    if wnsize_dtype_device not in hann_window:
-        hann_window[wnsize_dtype_device] = torch.hann_window(win_size).to(
-            dtype=y.dtype, device=y.device
-        )
-
-    y = torch.nn.functional.pad(
-        y.unsqueeze(1),
-        (int((n_fft - hop_size) / 2), int((n_fft - hop_size) / 2)),
-        mode="reflect",
-    )
-    y = y.squeeze(1)
+    def __init__(self, n_fft, hop_size, win_size):
+        super().__init__()
+        self.n_fft = n_fft
+        self.hop_size = hop_size
+        self.register_buffer("basis", stft_conv_basis(n_fft, win_size).clone(), persistent=False)
 
-    spec = torch.stft(
-        y,
-        n_fft,
-        hop_length=hop_size,
-        win_length=win_size,
-        window=hann_window[wnsize_dtype_device],
-        center=center,
-        pad_mode="reflect",
-        normalized=False,
-        onesided=True,
-        return_complex=False,
-    )
+    def forward(self, y):
+        pad = int((self.n_fft - self.hop_size) / 2)
+        y = torch.nn.functional.pad(y.unsqueeze(1), (pad, pad), mode="reflect")
+        forward_transform = torch.nn.functional.conv1d(y, self.basis, stride=self.hop_size)
+        freq_cutoff = self.n_fft // 2 + 1
+        return torch.sqrt(forward_transform[:, :freq_cutoff].pow(2) + forward_transform[:, freq_cutoff:].pow(2) + 1e-6)
+
+
+spectrogram_backends = {
+    "torch": spectrogram_torch,
+    "conv": spectrogram_torch_conv,
+}
 
-    spec = torch.sqrt(spec.pow(2).sum(-1) + 1e-6)
 
-    spec = torch.matmul(mel_basis[fmax_dtype_device], spec)
+def spec_to_mel_torch(spec, n_fft, num_mels, sampling_rate, fmin, fmax):
+    mel = get_mel_basis(sampling_rate, n_fft, num_mels, fmin, fmax, spec.dtype, spec.device)
+    spec = torch.matmul(mel, spec)
     spec = spectral_normalize_torch(spec)
+    return spec
+
 
-    return spec
\ No newline at end of file
+def mel_spectrogram_torch(
+    y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False, check_range=False
+):
+    if check_range:
+        if torch.min(y) < -1.0:
+            print("min value is ", torch.min(y))
+        if torch.max(y) > 1.0:
+            print("max value is ", torch.max(y))
+
+    spec = spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=center)
+    return spec_to_mel_torch(spec, n_fft, num_mels, sampling_rate, fmin, fmax)
@@ -490,10 +490,20 @@ class SynthesizerTrn(nn.Module):
         return o, attn, y_mask, (z, z_p, m_p, logs_p)
 
     def voice_conversion(self, y, y_lengths, sid_src, sid_tgt, tau=1.0):
+        z, z_p, y_mask = self.voice_conversion_encode(y, y_lengths, sid_src, tau=tau)
+        o_hat, z_hat = self.voice_conversion_decode(z_p, y_mask, sid_tgt)
+        return o_hat, y_mask, (z, z_p, z_hat)
+
+    def voice_conversion_encode(self, y, y_lengths, sid_src, tau=1.0):
+        """Source side of `voice_conversion`, independent of the target speaker."""
         g_src = sid_src
-        g_tgt = sid_tgt
         z, m_q, logs_q, y_mask = self.enc_q(y, y_lengths, g=g_src if not self.zero_g else torch.zeros_like(g_src), tau=tau)
         z_p = self.flow(z, y_mask, g=g_src)
+        return z, z_p, y_mask
+
+    def voice_conversion_decode(self, z_p, y_mask, sid_tgt):
+        """Target side of `voice_conversion`: render a source latent `z_p` with `sid_tgt`."""
+        g_tgt = sid_tgt
         z_hat = self.flow(z_p, y_mask, g=g_tgt, reverse=True)
         o_hat = self.dec(z_hat * y_mask, g=g_tgt if not self.zero_g else torch.zeros_like(g_tgt))
-        return o_hat, y_mask, (z, z_p, z_hat)
+        return o_hat, z_hat
@@ -6,6 +6,7 @@ from zipfile import ZipFile
 import langid
 from openvoice import se_extractor
 from openvoice.api import BaseSpeakerTTS, ToneColorConverter
+from openvoice.pipeline import OpenVoicePipeline
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--share", action='store_true', default=False, help="make link public")
@@ -127,18 +128,12 @@ def predict(prompt, style, audio_file_pth, agree):
             None,
         )
 
-    src_path = f'{output_dir}/tmp.wav'
-    tts_model.tts(prompt, src_path, speaker=style, language=language)
-
     save_path = f'{output_dir}/output.wav'
-    # Run the tone color converter
+    # Run the base speaker TTS and the tone color converter, handing the audio over in memory
     encode_message = "@MyShell"
-    tone_color_converter.convert(
-        audio_src_path=src_path, 
-        src_se=source_se, 
-        tgt_se=target_se, 
-        output_path=save_path,
-        message=encode_message)
+    pipeline = OpenVoicePipeline(tts_model, tone_color_converter, source_se, target_se,
+                                 speaker=style, language=language, message=encode_message)
+    pipeline.run(prompt, output_path=save_path)
 
     text_hint += f'''Get response successfully \n'''
 
@@ -0,0 +1,131 @@
+"""Base TTS + tone color conversion without temporary files.
+
+    pipeline = OpenVoicePipeline(tts_model, tone_color_converter, source_se, target_se,
+                                 speaker=speaker_id)
+    audio = pipeline.run(text)                 # float32 at pipeline.sampling_rate
+    pipeline.run(text, output_path='out.wav')
+    for chunk in pipeline.stream(text):        # one converted sentence at a time
+        ...
+    for chunk in pipeline.stream(text, pipelined=True):  # convert k while synthesizing k+1
+        ...
+"""
+import threading
+import numpy as np
+from openvoice import utils
+from openvoice.api import BaseSpeakerTTS
+from openvoice.wav_writer import WavWriter
+
+_locks_lock = threading.Lock()
+
+
+def stage_lock(model):
+    """Lock serializing inference on `model`, shared by every pipeline that uses it."""
+    with _locks_lock:
+        if not hasattr(model, '_pipeline_lock'):
+            model._pipeline_lock = threading.Lock()
+        return model._pipeline_lock
+
+
+class OpenVoicePipeline(object):
+    """Base speaker TTS followed by tone color conversion, with audio handed over in memory.
+
+    `tts_model` is an OpenVoice `BaseSpeakerTTS` (`speaker` is a speaker name) or a
+    MeloTTS `TTS` (`speaker` is a speaker id). `source_se` is the base speaker's
+    embedding and `target_se` the default voice to clone; both can be overridden
+    per call. TTS output is resampled to the converter's rate when the two differ.
+    A `BaseSpeakerTTS` hands its audio over as a tensor that stays on the model's
+    device; MeloTTS returns a numpy buffer, which `encode_source` moves to the
+    converter's device.
+
+    Each stage holds a lock on its model, so concurrent callers (threads) are safe
+    and different requests can be in different stages at the same time.
+    """
+
+    def __init__(self, tts_model, tone_color_converter, source_se, target_se=None, speaker=None,
+                 language='English', tau=0.3, message="@MyShell"):
+        self.tts_model = tts_model
+        self.converter = tone_color_converter
+        self.source_se = source_se
+        self.target_se = target_se
+        self.speaker = speaker
+        self.language = language
+        self.tau = tau
+        self.message = message
+        self.tts_sampling_rate = tts_model.hps.data.sampling_rate
+        self.sampling_rate = tone_color_converter.hps.data.sampling_rate
+        self._tts_lock = stage_lock(tts_model)
+        self._vc_lock = stage_lock(tone_color_converter)
+
+    @property
+    def language_str(self):
+        if isinstance(self.tts_model, BaseSpeakerTTS):
+            return BaseSpeakerTTS.language_marks[self.language.lower()]
+        # MeloTTS languages, e.g. EN_NEWEST; latin-script ones use the English splitter
+        language = getattr(self.tts_model, 'language', 'EN').split('_')[0]
+        return 'EN' if language in ('EN', 'ES', 'FR') else language
+
+    def synthesize(self, text, speed=1.0):
+        """Base speaker audio for `text` at the converter's sampling rate."""
+        with self._tts_lock:
+            if isinstance(self.tts_model, BaseSpeakerTTS):
+                audio = self.tts_model.tts(text, None, self.speaker, language=self.language, speed=speed,
+                                           return_tensor=True)
+            else:
+                audio = self.tts_model.tts_to_file(text, self.speaker, None, speed=speed, quiet=True)
+                audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        return utils.resample(audio, self.tts_sampling_rate, self.sampling_rate)
+
+    def convert(self, audio, src_se=None, tgt_se=None):
+        """Tone color conversion of a float32 buffer or tensor at the converter's sampling rate."""
+        src_se = self.source_se if src_se is None else src_se
+        tgt_se = self.target_se if tgt_se is None else tgt_se
+        assert tgt_se is not None, "no target speaker embedding given"
+        with self._vc_lock:
+            z_p, y_mask = self.converter.encode_source(audio, src_se, tau=self.tau)
+            return self.converter.decode_target(z_p, y_mask, tgt_se, message=self.message)
+
+    def run(self, text, speed=1.0, target_se=None, output_path=None):
+        """Synthesize and convert `text`; returns float32 audio or writes it to `output_path`."""
+        audio = self.convert(self.synthesize(text, speed=speed), tgt_se=target_se)
+        if output_path is None:
+            return audio
+        with WavWriter(output_path, self.sampling_rate) as writer:
+            writer.write(audio)
+
+    def sentences(self, text):
+        """Split a string into sentences, or incrementally split an iterable of text deltas."""
+        if isinstance(text, str):
+            return utils.split_sentence(text, language_str=self.language_str)
+        return self._stream_sentences(text)
+
+    def _stream_sentences(self, text_stream):
+        return utils.stream_sentences(text_stream, language_str=self.language_str)
+
+    def stream(self, text, speed=1.0, target_se=None, pipelined=False, max_in_flight=2):
+        """Yield converted audio sentence by sentence.
+
+        `text` is a string or an iterable of text deltas (e.g. LLM tokens). Every chunk
+        keeps the trailing inter-sentence silence the base TTS appends.
+
+        With `pipelined`, sentence k+1 is synthesized on a background thread while
+        sentence k is converted, with at most `max_in_flight` synthesized sentences
+        waiting. Both stages share torch's intra-op thread pool (torch.set_num_threads
+        is process-wide), so the gain is largest when the stages run on a GPU or the
+        CPU has cores to spare.
+        """
+        def synthesize(sentence):
+            return self.synthesize(sentence, speed=speed)
+
+        def convert(audio):
+            return self.convert(audio, tgt_se=target_se)
+
+        if pipelined:
+            stages = utils.pipelined_stages(self.sentences(text), synthesize, convert, max_in_flight=max_in_flight)
+            try:
+                for audio in stages:
+                    yield audio
+            finally:
+                stages.close()
+            return
+        for sentence in self.sentences(text):
+            yield convert(synthesize(sentence))
@@ -1,165 +1,323 @@
 import os
-import glob
 import torch
+import threading
+import contextlib
 import hashlib
-import librosa
-import base64
-from glob import glob
 import numpy as np
-from pydub import AudioSegment
-from faster_whisper import WhisperModel
-import hashlib
-import base64
-import librosa
-from whisper_timestamped.transcribe import get_audio_tensor, get_vad_segments
+from openvoice.utils import BoundedCache, resample
+# librosa, soundfile, faster_whisper and whisper_timestamped are imported by the functions
+# that need them, so importing this module stays cheap
 
-model_size = "medium"
-# Run on GPU with FP16
-model = None
+# Default faster-whisper settings; on GPU use device="cuda", compute_type="float16".
+# compute_type can also be "int8" / "int8_float16" for quantized inference.
+WHISPER_CONFIG = dict(
+    model_size="medium",
+    device="cpu",
+    compute_type="float32",
+    num_workers=1,
+    cpu_threads=0,
+)
 
 
-def split_audio_whisper(audio_path, audio_name, target_dir="processed"):
-    global model
-    if model is None:
-        # model = WhisperModel(model_size, device="cuda", compute_type="float16")
-        model = WhisperModel(model_size, device="cpu", compute_type="float32")
-    audio = AudioSegment.from_file(audio_path)
-    max_len = len(audio)
+class WhisperModelPool(object):
+    """Thread-safe cache of faster-whisper models, one per configuration.
 
-    target_folder = os.path.join(target_dir, audio_name)
+    A faster-whisper model runs up to `num_workers` transcriptions in parallel, so
+    each configuration is loaded once and concurrent callers share it through
+    `acquire`, which blocks while all of its workers are busy.
+    """
 
-    segments, info = model.transcribe(audio_path, beam_size=5, word_timestamps=True)
-    segments = list(segments)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
 
-    # create directory
-    os.makedirs(target_folder, exist_ok=True)
-    wavs_folder = os.path.join(target_folder, "wavs")
-    os.makedirs(wavs_folder, exist_ok=True)
+    def get(self, model_size, device, compute_type, num_workers=1, cpu_threads=0):
+        key = (model_size, device, compute_type, num_workers, cpu_threads)
+        with self._lock:
+            if key not in self._models:
+                from faster_whisper import WhisperModel
+                model = WhisperModel(model_size, device=device, compute_type=compute_type,
+                                     num_workers=num_workers, cpu_threads=cpu_threads)
+                self._models[key] = (model, threading.BoundedSemaphore(num_workers))
+            return self._models[key]
+
+    @contextlib.contextmanager
+    def acquire(self, **config):
+        model, workers = self.get(**config)
+        with workers:
+            yield model
+
+
+whisper_pool = WhisperModelPool()
+
+
+VAD_SAMPLE_RATE = 16000
+_silero_vad = None
+_silero_lock = threading.Lock()
+
+
+def get_silero_vad():
+    """Load Silero VAD once per process and keep it resident."""
+    global _silero_vad
+    with _silero_lock:
+        if _silero_vad is None:
+            model, vad_utils = torch.hub.load(repo_or_dir="snakers4/silero-vad:v4.0", model="silero_vad", onnx=False,
+                                             trust_repo=True)
+            _silero_vad = (model, vad_utils[0])
+        return _silero_vad
+
+
+def speech_regions_silero(audio_16k, min_speech_duration=0.1, min_silence_duration=0.3):
+    model, get_speech_timestamps = get_silero_vad()
+    # the model keeps recurrent state between chunks, so calls must not interleave
+    with _silero_lock:
+        timestamps = get_speech_timestamps(
+            torch.from_numpy(audio_16k),
+            model,
+            sampling_rate=VAD_SAMPLE_RATE,
+            min_speech_duration_ms=int(min_speech_duration * 1000),
+            min_silence_duration_ms=int(min_silence_duration * 1000),
+        )
+    return [(ts["start"] / VAD_SAMPLE_RATE, ts["end"] / VAD_SAMPLE_RATE) for ts in timestamps]
+
+
+def speech_regions_energy(audio_16k, min_speech_duration=0.1, min_silence_duration=0.3, threshold_db=-25.0):
+    """Frame-energy VAD: speech is any 30ms frame within `threshold_db` of the loudest frame."""
+    frame, hop = int(0.03 * VAD_SAMPLE_RATE), int(0.01 * VAD_SAMPLE_RATE)
+    if len(audio_16k) < frame:
+        return []
+    n_frames = 1 + (len(audio_16k) - frame) // hop
+    frames = np.lib.stride_tricks.as_strided(
+        audio_16k, shape=(n_frames, frame), strides=(audio_16k.strides[0] * hop, audio_16k.strides[0])
+    )
+    rms_db = 20 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-8)
+    active = rms_db > max(rms_db.max() + threshold_db, -60.0)
+
+    regions = []
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], active.astype(np.int8), [0]])))
+    for start, end in zip(edges[::2], edges[1::2]):
+        start_time, end_time = float(start * hop / VAD_SAMPLE_RATE), float(((end - 1) * hop + frame) / VAD_SAMPLE_RATE)
+        if len(regions) > 0 and start_time - regions[-1][1] < min_silence_duration:
+            regions[-1] = (regions[-1][0], end_time)
+        else:
+            regions.append((start_time, end_time))
+    return [(s, e) for s, e in regions if e - s >= min_speech_duration]
 
-    # segments
-    s_ind = 0
-    start_time = None
 
+def decode_audio(audio_path):
+    """Decode a file once into a mono float32 buffer at its native sampling rate."""
+    import librosa
+    audio, sr = librosa.load(audio_path, sr=None, mono=True)
+    return audio, sr
+
+
+def whisper_regions(audio_16k, whisper_config=None):
+    """Utterance (start, end) times in seconds from faster-whisper segments, with 0.08s
+    margins, keeping segments of 1.5s-20s with 2-199 characters of text."""
+    max_time = len(audio_16k) / VAD_SAMPLE_RATE
+
+    config = dict(WHISPER_CONFIG, **(whisper_config or {}))
+    with whisper_pool.acquire(**config) as model:
+        segments, info = model.transcribe(audio_16k, beam_size=5, word_timestamps=True)
+        # transcription is lazy, consume it while holding the worker
+        segments = list(segments)
+
+    regions = []
+    start_time = None
     for k, w in enumerate(segments):
         # process with the time
         if k == 0:
             start_time = max(0, w.start)
-
-        end_time = w.end
-
-        # calculate confidence
-        if len(w.words) > 0:
-            confidence = sum([s.probability for s in w.words]) / len(w.words)
-        else:
-            confidence = 0.0
+        # left 0.08s for each audios
+        end_time = min(max_time, w.end + 0.08)
         # clean text
         text = w.text.replace("...", "")
 
-        # left 0.08s for each audios
-        audio_seg = audio[
-            int(start_time * 1000) : min(max_len, int(end_time * 1000) + 80)
-        ]
-
-        # segment file name
-        fname = f"{audio_name}_seg{s_ind}.wav"
-
         # filter out the segment shorter than 1.5s and longer than 20s
-        save = (
-            audio_seg.duration_seconds > 1.5
-            and audio_seg.duration_seconds < 20.0
-            and len(text) >= 2
-            and len(text) < 200
-        )
-
-        if save:
-            output_file = os.path.join(wavs_folder, fname)
-            audio_seg.export(output_file, format="wav")
+        if 1.5 < end_time - start_time < 20.0 and 2 <= len(text) < 200:
+            regions.append((start_time, end_time))
 
         if k < len(segments) - 1:
             start_time = max(0, segments[k + 1].start - 0.08)
+    return regions
 
-        s_ind = s_ind + 1
-    return wavs_folder
 
+def utterance_regions(audio_16k, method="silero", min_duration=1.5, max_duration=20.0):
+    """Utterance (start, end) times in seconds from VAD only, without transcribing.
+
+    Comparable to `whisper_regions` (0.08s margins, kept only when 1.5s < duration < 20s)
+    from Silero (`method="silero"`) or frame-energy (`method="energy"`) speech regions.
+    Regions longer than `max_duration` are split evenly instead of being dropped.
+    """
+    if method == "silero":
+        speech = speech_regions_silero(audio_16k)
+    elif method == "energy":
+        speech = speech_regions_energy(audio_16k)
+    else:
+        raise ValueError(f"unknown segmentation method {method}")
+
+    max_time = len(audio_16k) / VAD_SAMPLE_RATE
+    regions = []
+    for start_time, end_time in speech:
+        # every piece gets 0.08s of padding on both sides, so the span left for speech is max_duration - 0.16
+        n_pieces = int(np.ceil((end_time - start_time) / (max_duration - 0.16)))
+        bounds = np.linspace(start_time, end_time, n_pieces + 1)
+        for piece_start, piece_end in zip(bounds[:-1], bounds[1:]):
+            # left 0.08s for each audios
+            seg_start, seg_end = max(0, float(piece_start) - 0.08), min(max_time, float(piece_end) + 0.08)
+            if min_duration < seg_end - seg_start < max_duration:
+                regions.append((seg_start, seg_end))
+    return regions
+
+
+def vad_pieces(audio, sr, audio_16k, split_seconds=10.0):
+    """Concatenate the speech found by whisper-timestamped's Silero VAD and cut it
+    into pieces of about `split_seconds`. Returns buffers at `sr`."""
+    from whisper_timestamped.transcribe import get_vad_segments
 
-def split_audio_vad(audio_path, audio_name, target_dir, split_seconds=10.0):
-    SAMPLE_RATE = 16000
-    audio_vad = get_audio_tensor(audio_path)
     segments = get_vad_segments(
-        audio_vad,
+        torch.from_numpy(audio_16k),
         output_sample=True,
         min_speech_duration=0.1,
         min_silence_duration=1,
         method="silero",
     )
-    segments = [(seg["start"], seg["end"]) for seg in segments]
-    segments = [(float(s) / SAMPLE_RATE, float(e) / SAMPLE_RATE) for s, e in segments]
+    segments = [(float(seg["start"]) / VAD_SAMPLE_RATE, float(seg["end"]) / VAD_SAMPLE_RATE) for seg in segments]
     print(segments)
-    audio_active = AudioSegment.silent(duration=0)
-    audio = AudioSegment.from_file(audio_path)
+    audio_active = np.concatenate([audio[int(s * sr): int(e * sr)] for s, e in segments] + [audio[:0]])
 
-    for start_time, end_time in segments:
-        audio_active += audio[int(start_time * 1000) : int(end_time * 1000)]
-
-    audio_dur = audio_active.duration_seconds
+    audio_dur = len(audio_active) / sr
     print(f"after vad: dur = {audio_dur}")
-    target_folder = os.path.join(target_dir, audio_name)
-    wavs_folder = os.path.join(target_folder, "wavs")
-    os.makedirs(wavs_folder, exist_ok=True)
-    start_time = 0.0
-    count = 0
     num_splits = int(np.round(audio_dur / split_seconds))
     assert num_splits > 0, "input audio is too short"
-    interval = audio_dur / num_splits
-
-    for i in range(num_splits):
-        end_time = min(start_time + interval, audio_dur)
-        if i == num_splits - 1:
-            end_time = audio_dur
-        output_file = f"{wavs_folder}/{audio_name}_seg{count}.wav"
-        audio_seg = audio_active[int(start_time * 1000) : int(end_time * 1000)]
-        audio_seg.export(output_file, format="wav")
-        start_time = end_time
-        count += 1
+    bounds = np.linspace(0, len(audio_active), num_splits + 1).astype(int)
+    return [audio_active[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def cut_regions(audio, sr, regions):
+    return [audio[int(start_time * sr): int(end_time * sr)] for start_time, end_time in regions]
+
+
+def _write_segments(segments, sr, audio_name, target_dir):
+    import soundfile
+    wavs_folder = os.path.join(target_dir, audio_name, "wavs")
+    os.makedirs(wavs_folder, exist_ok=True)
+    for s_ind, audio_seg in enumerate(segments):
+        soundfile.write(os.path.join(wavs_folder, f"{audio_name}_seg{s_ind}.wav"), audio_seg, sr)
     return wavs_folder
 
 
+def split_audio_whisper(audio_path, audio_name, target_dir="processed", whisper_config=None):
+    audio, sr = decode_audio(audio_path)
+    regions = whisper_regions(resample(audio, sr, VAD_SAMPLE_RATE), whisper_config=whisper_config)
+    return _write_segments(cut_regions(audio, sr, regions), sr, audio_name, target_dir)
+
+
+def split_audio_vad(audio_path, audio_name, target_dir, split_seconds=10.0):
+    audio, sr = decode_audio(audio_path)
+    pieces = vad_pieces(audio, sr, resample(audio, sr, VAD_SAMPLE_RATE), split_seconds=split_seconds)
+    return _write_segments(pieces, sr, audio_name, target_dir)
+
+
+def split_audio_segments(audio_path, audio_name, target_dir="processed", method="silero",
+                         min_duration=1.5, max_duration=20.0):
+    audio, sr = decode_audio(audio_path)
+    regions = utterance_regions(resample(audio, sr, VAD_SAMPLE_RATE), method=method,
+                                min_duration=min_duration, max_duration=max_duration)
+    return _write_segments(cut_regions(audio, sr, regions), sr, audio_name, target_dir)
+
+
+# hex digest length used in cache names: 128 bits, filesystem safe
+HASH_LEN = 32
+# keyed by _stat_key(path, mode)
+_hash_memo = BoundedCache(max_size=1024)
+
+
+def hash_audio(array):
+    """Hash of a decoded PCM buffer, so re-encodings of the same samples share a key."""
+    return hashlib.sha256(np.ascontiguousarray(array, dtype=np.float32).tobytes()).hexdigest()[:HASH_LEN]
+
+
+def _stat_key(audio_path, mode):
+    st = os.stat(audio_path)
+    return (os.path.realpath(audio_path), mode, st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def hash_file(audio_path, mode="bytes", chunk_size=1 << 20):
+    """Cache key of an audio file.
+
+    mode="bytes" streams the raw file through SHA-256 in `chunk_size` chunks without
+    decoding it; mode="pcm" hashes the decoded samples instead. Results are memoized
+    on (path, size, mtime, inode) for the last 1024 files, so unchanged files are not
+    hashed again.
+    """
+    def digest():
+        if mode == "bytes":
+            h = hashlib.sha256()
+            with open(audio_path, "rb") as f:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    h.update(chunk)
+            return h.hexdigest()[:HASH_LEN]
+        elif mode == "pcm":
+            return hash_audio(decode_audio(audio_path)[0])
+        raise ValueError(f"unknown hash mode {mode}")
+
+    return _hash_memo.get_or_create(_stat_key(audio_path, mode), digest)
+
+
 def hash_numpy_array(audio_path):
-    array, _ = librosa.load(audio_path, sr=None, mono=True)
-    # Convert the array to bytes
-    array_bytes = array.tobytes()
-    # Calculate the hash of the array bytes
-    hash_object = hashlib.sha256(array_bytes)
-    hash_value = hash_object.digest()
-    # Convert the hash value to base64
-    base64_value = base64.b64encode(hash_value)
-    return base64_value.decode("utf-8")[:16].replace("/", "_^")
-
-
-def get_se(audio_path, vc_model, target_dir="processed", vad=True):
-    device = vc_model.device
+    return hash_file(audio_path, mode="pcm")
+
+
+def get_se(audio_path, vc_model, target_dir="processed", vad=True, whisper_config=None, segmentation=None,
+           hash_mode="bytes", use_cache=False):
+    """Extract the tone color embedding of a reference speaker.
+
+    The file is decoded once, resampled to 16kHz for segmentation and to the
+    converter's rate for the embedding. The embedding is saved under a name keyed by
+    `hash_file(audio_path, hash_mode)`; with `use_cache=True` an existing one is
+    returned without decoding the audio.
+
+    `segmentation` selects how the reference is cut before embedding:
+        "vad": concatenate Silero speech and cut it into ~10s pieces (default when vad=True)
+        "whisper": faster-whisper transcription segments (default when vad=False)
+        "silero" / "energy": utterance segments from VAD only, no transcription
+    """
     version = vc_model.version
     print("OpenVoice version:", version)
 
-    audio_name = f"{os.path.basename(audio_path).rsplit('.', 1)[0]}_{version}_{hash_numpy_array(audio_path)}"
+    decoded = []
+    if hash_mode == "pcm":
+        # decode here on a cache miss so the buffer is shared with the embedding below
+        def decode_and_hash():
+            decoded.extend(decode_audio(audio_path))
+            return hash_audio(decoded[0])
+
+        _hash_memo.get_or_create(_stat_key(audio_path, hash_mode), decode_and_hash)
+    audio, sr = decoded if decoded else (None, None)
+    audio_name = f"{os.path.basename(audio_path).rsplit('.', 1)[0]}_{version}_{hash_file(audio_path, hash_mode)}"
     se_path = os.path.join(target_dir, audio_name, "se.pth")
 
-    # if os.path.isfile(se_path):
-    #     se = torch.load(se_path).to(device)
-    #     return se, audio_name
-    # if os.path.isdir(audio_path):
-    #     wavs_folder = audio_path
+    if use_cache and os.path.isfile(se_path):
+        se = torch.load(se_path, map_location="cpu").to(vc_model.device)
+        return se, audio_name
 
-    if vad:
-        wavs_folder = split_audio_vad(
-            audio_path, target_dir=target_dir, audio_name=audio_name
-        )
+    if audio is None:
+        audio, sr = decode_audio(audio_path)
+
+    if segmentation is None:
+        segmentation = "vad" if vad else "whisper"
+
+    audio_16k = resample(audio, sr, VAD_SAMPLE_RATE)
+    target_sr = vc_model.hps.data.sampling_rate
+    audio = resample(audio, sr, target_sr)
+    if segmentation == "vad":
+        audio_segs = vad_pieces(audio, target_sr, audio_16k)
+    elif segmentation == "whisper":
+        audio_segs = cut_regions(audio, target_sr, whisper_regions(audio_16k, whisper_config=whisper_config))
     else:
-        wavs_folder = split_audio_whisper(
-            audio_path, target_dir=target_dir, audio_name=audio_name
-        )
+        audio_segs = cut_regions(audio, target_sr, utterance_regions(audio_16k, method=segmentation))
 
-    audio_segs = glob(f"{wavs_folder}/*.wav")
     if len(audio_segs) == 0:
         raise NotImplementedError("No audio segments found!")
 
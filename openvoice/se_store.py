@@ -0,0 +1,241 @@
+"""On-disk store for speaker embeddings with cosine nearest-neighbour search.
+
+Embeddings live in one memory-mapped float32 matrix (`embeddings.f32`, one row per
+voice) next to a JSON table (`meta.json`) mapping voice IDs to rows and metadata.
+
+    store = SpeakerEmbeddingStore('se_store')
+    store.import_se_files('checkpoints_v2/base_speakers/ses/*.pth')
+    store.search(target_se, k=3)    # [(id, cosine similarity), ...]
+    store.get_se('en-us', device)   # [1, dim, 1] tensor, as returned by extract_se
+
+With `root=None` the store lives in memory only (nothing is written to disk).
+"""
+import os
+import json
+import threading
+from glob import glob
+import numpy as np
+import torch
+
+
+class SpeakerEmbeddingStore(object):
+    """Memory-mapped speaker embedding matrix with metadata and kNN search.
+
+    Rows of removed voices are reused by later additions; the file grows by
+    doubling. Reads and mutations hold a lock, and `save` writes the metadata atomically.
+    Searches are exact (vectorized numpy) unless `build_index` created an
+    approximate faiss index.
+    """
+
+    def __init__(self, root=None, dim=256, capacity=1024):
+        self.root = root
+        self.matrix_path = os.path.join(root, 'embeddings.f32') if root is not None else None
+        self.meta_path = os.path.join(root, 'meta.json') if root is not None else None
+        self._lock = threading.Lock()
+        self._index = None
+        self._unit = None
+        self.matrix = None
+
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+        if root is not None and os.path.isfile(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.dim = meta['dim']
+            self.rows = meta['rows']
+            self.metadata = meta['metadata']
+            capacity = max(meta['capacity'], 1)
+        else:
+            self.dim = dim
+            self.rows = {}
+            self.metadata = {}
+        self._free = sorted(set(range(capacity)) - set(self.rows.values()), reverse=True)
+        self._open(capacity)
+
+    def _open(self, capacity):
+        if self.root is None:
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            if self.matrix is not None:
+                matrix[:self.capacity] = self.matrix
+            self.capacity = capacity
+            self.matrix = matrix
+            return
+        nbytes = capacity * self.dim * 4
+        mode = 'r+b' if os.path.isfile(self.matrix_path) else 'w+b'
+        with open(self.matrix_path, mode) as f:
+            f.truncate(nbytes)
+        self.capacity = capacity
+        self.matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+
+    def _grow(self, n_needed):
+        capacity = self.capacity
+        while capacity - len(self.rows) < n_needed:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+        if self.root is not None:
+            self.matrix.flush()
+            del self.matrix
+        old_capacity = self.capacity
+        self._open(capacity)
+        self._free = list(range(capacity - 1, old_capacity - 1, -1)) + self._free
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, voice_id):
+        return voice_id in self.rows
+
+    def ids(self):
+        return list(self.rows)
+
+    @staticmethod
+    def _as_matrix(embeddings):
+        if isinstance(embeddings, torch.Tensor):
+            embeddings = embeddings.detach().cpu().float().numpy()
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        # extract_se returns [1, dim, 1]
+        return embeddings.reshape(-1, embeddings.shape[-2] if embeddings.ndim == 3 else embeddings.shape[-1])
+
+    def add(self, ids, embeddings, metadata=None):
+        """Add or replace voices. `embeddings` is [n, dim] (or a stack of [1, dim, 1] SEs)."""
+        if isinstance(ids, str):
+            ids = [ids]
+        embeddings = self._as_matrix(embeddings)
+        assert embeddings.shape == (len(ids), self.dim), \
+            f"expected {len(ids)} embeddings of dim {self.dim}, got {embeddings.shape}"
+        assert metadata is None or len(metadata) == len(ids)
+        with self._lock:
+            self._grow(sum(voice_id not in self.rows for voice_id in set(ids)))
+            for i, voice_id in enumerate(ids):
+                if voice_id not in self.rows:
+                    self.rows[voice_id] = self._free.pop()
+                self.matrix[self.rows[voice_id]] = embeddings[i]
+                self.metadata[voice_id] = metadata[i] if metadata is not None else self.metadata.get(voice_id, {})
+            self._index = self._unit = None
+
+    def remove(self, ids):
+        if isinstance(ids, str):
+            ids = [ids]
+        with self._lock:
+            for voice_id in ids:
+                row = self.rows.pop(voice_id, None)
+                if row is not None:
+                    self.matrix[row] = 0
+                    self._free.append(row)
+                    self.metadata.pop(voice_id, None)
+            self._index = self._unit = None
+
+    def get(self, voice_id):
+        """Embedding of one voice as a float32 [dim] array."""
+        # under the lock: `add` may be replacing self.matrix with a larger mapping
+        with self._lock:
+            return np.array(self.matrix[self.rows[voice_id]])
+
+    def get_se(self, voice_id, device='cpu'):
+        """Embedding of one voice as a [1, dim, 1] tensor, like `ToneColorConverter.extract_se`."""
+        return torch.from_numpy(self.get(voice_id)).view(1, -1, 1).to(device)
+
+    def save(self):
+        assert self.root is not None, "in-memory store, nothing to save"
+        with self._lock:
+            self.matrix.flush()
+            meta = dict(dim=self.dim, capacity=self.capacity, rows=self.rows, metadata=self.metadata)
+            tmp_path = self.meta_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, self.meta_path)
+
+    def import_se_files(self, pattern, id_fn=None):
+        """Add `se.pth` style files matching a glob pattern (or a list of paths).
+
+        Voice IDs default to the file name without extension, or the parent directory
+        name for `processed/<audio_name>/se.pth`.
+        """
+        paths = sorted(glob(pattern)) if isinstance(pattern, str) else list(pattern)
+        if id_fn is None:
+            def id_fn(path):
+                name = os.path.basename(path).rsplit('.', 1)[0]
+                return os.path.basename(os.path.dirname(path)) if name == 'se' else name
+        if len(paths) == 0:
+            return []
+        ids = [id_fn(path) for path in paths]
+        embeddings = np.stack([self._as_matrix(torch.load(path, map_location='cpu'))[0] for path in paths])
+        self.add(ids, embeddings, metadata=[{'path': path} for path in paths])
+        return ids
+
+    def _normalized(self):
+        # unit-norm copy of the live rows, kept until the next add/remove
+        if self._unit is None:
+            ids = list(self.rows)
+            vectors = self.matrix[[self.rows[voice_id] for voice_id in ids]]
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-8)
+            self._unit = (ids, vectors.astype(np.float32))
+        return self._unit
+
+    def build_index(self, m=32):
+        """Build an approximate (HNSW) index with faiss, which must be installed.
+        The index is dropped by the next add/remove."""
+        import faiss
+        with self._lock:
+            ids, vectors = self._normalized()
+            index = faiss.IndexHNSWFlat(self.dim, m, faiss.METRIC_INNER_PRODUCT)
+            index.add(vectors)
+            self._index = (ids, index)
+
+    def search(self, queries, k=5, candidates=None):
+        """Cosine k-nearest neighbours of one or more query embeddings.
+
+        `candidates` restricts the search to a subset of IDs (always exact).
+
+        Returns:
+            list of (id, similarity) sorted by decreasing similarity, or one such
+            list per query when several queries are given.
+        """
+        queries = self._as_matrix(queries)
+        single = queries.shape[0] == 1
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-8)
+
+        with self._lock:
+            if self._index is not None and candidates is None:
+                ids, index = self._index
+                scores, rows = index.search(queries, min(k, len(ids)))
+            else:
+                ids, vectors = self._normalized()
+                if candidates is not None:
+                    candidates = set(candidates)
+                    keep = [i for i, voice_id in enumerate(ids) if voice_id in candidates]
+                    ids, vectors = [ids[i] for i in keep], vectors[keep]
+                sims = queries @ vectors.T
+                k_ = min(k, len(ids))
+                rows = np.argpartition(-sims, k_ - 1, axis=1)[:, :k_] if k_ > 0 else np.zeros((len(queries), 0), int)
+                scores = np.take_along_axis(sims, rows, axis=1)
+                order = np.argsort(-scores, axis=1)
+                rows, scores = np.take_along_axis(rows, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+        results = [[(ids[r], float(s)) for r, s in zip(row, score) if r >= 0] for row, score in zip(rows, scores)]
+        return results[0] if single else results
+
+    def duplicates(self, threshold=0.95, batch_size=4096):
+        """Pairs of voices (id_a, id_b, similarity) whose cosine similarity is >= threshold."""
+        with self._lock:
+            ids, vectors = self._normalized()
+        pairs = []
+        for start in range(0, len(ids), batch_size):
+            sims = vectors[start: start + batch_size] @ vectors.T
+            for i, j in zip(*np.nonzero(sims >= threshold)):
+                if start + i < j:
+                    pairs.append((ids[start + i], ids[j], float(sims[i, j])))
+        return pairs
+
+
+def nearest_base_speakers(store, target_se, spk2id, k=1):
+    """Base speakers of a TTS model closest to `target_se`, as
+    [(speaker_key, speaker_id, similarity)] best first.
+
+    `store` holds the base speaker SEs under their file names
+    (`base_speakers/ses/<key>.pth`, key lower-cased with '-' for '_').
+    """
+    keys = {key.lower().replace('_', '-'): key for key in spk2id}
+    matches = store.search(target_se, k=k, candidates=[name for name in keys if name in store])
+    return [(keys[name], spk2id[keys[name]], similarity) for name, similarity in matches]
@@ -1,5 +1,4 @@
 """ from https://github.com/keithito/tacotron """
-from openvoice.text import cleaners
 from openvoice.text.symbols import symbols
 
 
@@ -71,6 +70,8 @@ def sequence_to_text(sequence):
 
 
 def _clean_text(text, cleaner_names):
+  # cleaners pull in the language front-ends (inflect, jieba, ...), import them on first use
+  from openvoice.text import cleaners
   for name in cleaner_names:
     cleaner = getattr(cleaners, name)
     if not cleaner:
@@ -1,8 +1,18 @@
 import re
-from openvoice.text.english import english_to_lazy_ipa, english_to_ipa2, english_to_lazy_ipa2
-from openvoice.text.mandarin import number_to_chinese, chinese_to_bopomofo, latin_to_bopomofo, chinese_to_romaji, chinese_to_lazy_ipa, chinese_to_ipa, chinese_to_ipa2
+
+
+def chinese_to_ipa(text):
+    from openvoice.text.mandarin import chinese_to_ipa
+    return chinese_to_ipa(text)
+
+
+def english_to_ipa2(text):
+    from openvoice.text.english import english_to_ipa2
+    return english_to_ipa2(text)
+
 
 def cjke_cleaners2(text):
+    # the language front-ends are imported only when text in that language is seen
     text = re.sub(r'\[ZH\](.*?)\[ZH\]',
                   lambda x: chinese_to_ipa(x.group(1))+' ', text)
     text = re.sub(r'\[JA\](.*?)\[JA\]',
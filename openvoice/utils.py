@@ -1,5 +1,8 @@
 import re
 import json
+import queue
+import threading
+from collections import OrderedDict
 import numpy as np
 
 
@@ -43,54 +46,260 @@ class HParams:
         return self.__dict__.__repr__()
 
 
+class BoundedCache(object):
+    """Thread-safe LRU cache holding at most `max_size` entries.
+
+    `get_or_create(key, factory)` builds missing values outside the cache lock, so
+    a slow factory never blocks lookups of other keys. Concurrent callers asking for
+    the same missing key wait on a per-key lock, so an entry is never built twice.
+    """
+
+    def __init__(self, max_size=16):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._building = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key):
+        # call with self._lock held
+        if key in self._items:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return True, self._items[key]
+        return False, None
+
+    def get_or_create(self, key, factory):
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+            key_lock = self._building.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                with self._lock:
+                    found, value = self._lookup(key)
+                    if found:
+                        return value
+                    self.misses += 1
+                value = factory()
+                with self._lock:
+                    self._items[key] = value
+                    self._items.move_to_end(key)
+                    if len(self._items) > self.max_size:
+                        self._items.popitem(last=False)
+                        self.evictions += 1
+                return value
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self._building[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        with self._lock:
+            return dict(size=len(self._items), max_size=self.max_size, hits=self.hits,
+                        misses=self.misses, evictions=self.evictions)
+
+
+def _sinc_resample(audio, orig_sr, target_sr, lowpass_filter_width=6, rolloff=0.99):
+    """Polyphase windowed-sinc resampling of a [..., t] tensor on its own device."""
+    import math
+    import torch
+    gcd = math.gcd(orig_sr, target_sr)
+    orig, new = orig_sr // gcd, target_sr // gcd
+    base_freq = min(orig, new) * rolloff
+    width = int(math.ceil(lowpass_filter_width * orig / base_freq))
+
+    # one Hann-windowed sinc kernel per output phase, as in torchaudio.functional.resample
+    idx = torch.arange(-width, width + orig, dtype=torch.float64, device=audio.device)[None, None] / orig
+    t = (torch.arange(0, -new, -1, dtype=torch.float64, device=audio.device)[:, None, None] / new + idx) * base_freq
+    t = t.clamp(-lowpass_filter_width, lowpass_filter_width)
+    window = torch.cos(t * math.pi / lowpass_filter_width / 2) ** 2
+    t = t * math.pi
+    kernels = torch.where(t == 0, torch.ones_like(t), torch.sin(t) / t) * window * (base_freq / orig)
+
+    shape = audio.shape
+    y = audio.reshape(-1, 1, shape[-1]).float()
+    y = torch.nn.functional.pad(y, (width, width + orig))
+    y = torch.nn.functional.conv1d(y, kernels.to(y.dtype), stride=orig)
+    y = y.transpose(1, 2).reshape(y.size(0), -1)
+    n_out = int(math.ceil(new * shape[-1] / orig))
+    return y[:, :n_out].reshape(shape[:-1] + (n_out,))
+
+
+def resample(audio, orig_sr, target_sr):
+    """Resample audio from `orig_sr` to `target_sr`.
+
+    numpy buffers go through librosa. Torch tensors ([..., t]) are resampled on
+    their own device with a windowed-sinc filter, so GPU audio stays there.
+    """
+    if orig_sr == target_sr:
+        return audio
+    import torch
+    if isinstance(audio, torch.Tensor):
+        return _sinc_resample(audio, orig_sr, target_sr)
+    import librosa
+    return librosa.resample(np.asarray(audio, dtype=np.float32), orig_sr=orig_sr, target_sr=target_sr)
+
+
 def string_to_bits(string, pad_len=8):
-    # Convert each character to its ASCII value
-    ascii_values = [ord(char) for char in string]
-    
-    # Convert ASCII values to binary representation
-    binary_values = [bin(value)[2:].zfill(8) for value in ascii_values]
-    
-    # Convert binary strings to integer arrays
-    bit_arrays = [[int(bit) for bit in binary] for binary in binary_values]
-    
-    # Convert list of arrays to NumPy array
-    numpy_array = np.array(bit_arrays)
-    numpy_array_full = np.zeros((pad_len, 8), dtype=numpy_array.dtype)
-    numpy_array_full[:, 2] = 1
-    max_len = min(pad_len, len(numpy_array))
-    numpy_array_full[:max_len] = numpy_array[:max_len]
-    return numpy_array_full
+    return strings_to_bits([string], pad_len=pad_len)[0]
 
 
 def bits_to_string(bits_array):
-    # Convert each row of the array to a binary string
-    binary_values = [''.join(str(bit) for bit in row) for row in bits_array]
-    
-    # Convert binary strings to ASCII values
-    ascii_values = [int(binary, 2) for binary in binary_values]
-    
-    # Convert ASCII values to characters
-    output_string = ''.join(chr(value) for value in ascii_values)
-    
-    return output_string
-
-
-def split_sentence(text, min_len=10, language_str='[EN]'):
+    return bits_to_strings(np.asarray(bits_array)[None])[0]
+
+
+def strings_to_bits(strings, pad_len=8):
+    """Encode messages as a [n, pad_len, 8] bit array, one byte per row (MSB first).
+
+    Messages are truncated to `pad_len` characters; padding rows only have column 2 set.
+    """
+    # a padding row with only column 2 set is the byte 0b00100000
+    codes = np.full((len(strings), pad_len), 0b00100000, dtype=np.uint8)
+    for i, string in enumerate(strings):
+        values = np.frombuffer(string.encode('latin-1'), dtype=np.uint8)[:pad_len]
+        codes[i, :len(values)] = values
+    return np.unpackbits(codes[..., None], axis=-1).astype(np.int64)
+
+
+def bits_to_strings(bits_array):
+    """Decode a [n, rows, 8] bit array back into n strings."""
+    codes = np.packbits(np.asarray(bits_array, dtype=np.uint8), axis=-1)[..., 0]
+    return [row.tobytes().decode('latin-1') for row in codes]
+
+
+def split_sentence(text, min_len=10, language_str='[EN]', mode='default', **budget_kwargs):
+    if mode == 'budget':
+        spans = split_sentence_spans(text, **budget_kwargs)
+        sentences = [clean_sentence(text[start:end], language_str) for start, end in spans]
+        return [sentence for sentence in sentences if len(sentence) > 0]
     if language_str in ['EN']:
         sentences = split_sentences_latin(text, min_len=min_len)
     else:
         sentences = split_sentences_zh(text, min_len=min_len)
     return sentences
 
-def split_sentences_latin(text, min_len=10):
-    """Split Long sentences into list of short ones
+
+# CJK punctuation always ends a clause; latin punctuation only when followed by
+# whitespace (or the end of the text), so "3.14" and "1,000" stay whole
+_clause_end_re = re.compile(r'[，。！？；]+[”’」』）)]*|[,.!?;]+["\'”’)\]]*(?=\s|$)')
+_abbreviations = {'mr', 'mrs', 'ms', 'dr', 'drs', 'st', 'co', 'jr', 'sr', 'maj', 'gen', 'rev', 'lt',
+                  'hon', 'sgt', 'capt', 'esq', 'ltd', 'col', 'ft', 'vs', 'etc', 'e.g', 'i.e'}
+
+
+def _is_abbreviation(text, end):
+    """Whether the '.' at text[end - 1] closes a known abbreviation such as "Mr."."""
+    if text[end - 1] != '.':
+        return False
+    words = text[:end - 1].split()
+    return len(words) > 0 and words[-1].lower() in _abbreviations
+
+
+def _default_token_len(text):
+    # Non-space characters are a cheap proxy for the phoneme count after cleaning.
+    return len(re.sub(r'\s+', '', text))
+
+
+def _strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _split_long_span(text, start, end):
+    """Break a clause that alone exceeds the budget into words (or characters for ZH)."""
+    piece = text[start:end]
+    if re.search(r'\s', piece):
+        return [(start + m.start(), start + m.end()) for m in re.finditer(r'\S+', piece)]
+    return [(start + i, start + i + 1) for i in range(len(piece))]
+
+
+def split_sentence_spans(text, target_tokens=100, min_tokens=30, max_tokens=200, length_fn=None):
+    """Split text into chunks of balanced token length, for batched inference.
+
+    Chunks are cut at punctuation (latin punctuation only when whitespace follows,
+    and never after abbreviations like "Mr.") and grouped so that every chunk stays within
+    [min_tokens, max_tokens] (whenever the text allows it) while staying as close
+    as possible to `target_tokens` across the whole document. A clause longer
+    than `max_tokens` is cut between words (between characters for ZH).
 
     Args:
-        str: Input sentences.
+        text: input document.
+        target_tokens, min_tokens, max_tokens: budget in units of `length_fn`.
+        length_fn: callable returning the token/phoneme length of a string;
+            defaults to the number of non-space characters.
 
     Returns:
-        List[str]: list of output sentences.
+        List[Tuple[int, int]]: (start, end) character offsets into `text`.
     """
+    length_fn = length_fn or _default_token_len
+    assert 0 < min_tokens <= target_tokens <= max_tokens, "expected 0 < min_tokens <= target_tokens <= max_tokens"
+
+    ends = [m.end() for m in _clause_end_re.finditer(text) if not _is_abbreviation(text, m.end())]
+    if len(ends) == 0 or ends[-1] < len(text):
+        ends.append(len(text))
+
+    clauses = []
+    clause_start = 0
+    for clause_end in ends:
+        start, end = _strip_span(text, clause_start, clause_end)
+        clause_start = clause_end
+        if start == end:
+            continue
+        if length_fn(text[start:end]) > max_tokens:
+            clauses.extend(_split_long_span(text, start, end))
+        else:
+            clauses.append((start, end))
+    if len(clauses) == 0:
+        return []
+
+    lengths = [length_fn(text[s:e]) for s, e in clauses]
+    prefix = [0]
+    for n in lengths:
+        prefix.append(prefix[-1] + n)
+
+    # best[j]: minimal cost of chunking clauses[:j]; a chunk of total length n
+    # costs (n - target_tokens) ** 2, plus a large penalty below min_tokens.
+    n_clauses = len(clauses)
+    best = [0.] + [float('inf')] * n_clauses
+    back = [0] * (n_clauses + 1)
+    for j in range(1, n_clauses + 1):
+        for i in range(j - 1, -1, -1):
+            chunk_len = prefix[j] - prefix[i]
+            if chunk_len > max_tokens and i < j - 1:
+                break
+            cost = best[i] + (chunk_len - target_tokens) ** 2
+            if chunk_len < min_tokens:
+                cost += max_tokens ** 2
+            if cost < best[j]:
+                best[j] = cost
+                back[j] = i
+
+    spans = []
+    j = n_clauses
+    while j > 0:
+        i = back[j]
+        spans.append((clauses[i][0], clauses[j - 1][1]))
+        j = i
+    return spans[::-1]
+
+
+def clean_text_latin(text):
+    """Normalize punctuation and whitespace the way `split_sentences_latin` does."""
     # deal with dirty sentences
     text = re.sub('[。！？；]', '.', text)
     text = re.sub('[，]', ',', text)
@@ -98,6 +307,38 @@ def split_sentences_latin(text, min_len=10):
     text = re.sub('[‘’]', "'", text)
     text = re.sub(r"[\<\>\(\)\[\]\"\«\»]+", "", text)
     text = re.sub('[\n\t ]+', ' ', text)
+    return text
+
+
+def clean_text_zh(text):
+    """Normalize punctuation and whitespace the way `split_sentences_zh` does."""
+    text = re.sub('[。！？；]', '.', text)
+    text = re.sub('[，]', ',', text)
+    # 将文本中的换行符、空格和制表符替换为空格
+    text = re.sub('[\n\t ]+', ' ', text)
+    return text
+
+
+def clean_sentence(sentence, language_str='EN'):
+    """Text of one sentence exactly as `split_sentence` would pass it to the model."""
+    if language_str in ['EN']:
+        text = clean_text_latin(sentence)
+    else:
+        text = clean_text_zh(sentence)
+    text = re.sub('([,.!?;])', r'\1 ', text)
+    return re.sub('[\n\t ]+', ' ', text).strip()
+
+
+def split_sentences_latin(text, min_len=10):
+    """Split Long sentences into list of short ones
+
+    Args:
+        str: Input sentences.
+
+    Returns:
+        List[str]: list of output sentences.
+    """
+    text = clean_text_latin(text)
     text = re.sub('([,.!?;])', r'\1 $#!', text)
     # split
     sentences = [s.strip() for s in text.split('$#!')]
@@ -143,10 +384,7 @@ def merge_short_sentences_latin(sens):
     return sens_out
 
 def split_sentences_zh(text, min_len=10):
-    text = re.sub('[。！？；]', '.', text)
-    text = re.sub('[，]', ',', text)
-    # 将文本中的换行符、空格和制表符替换为空格
-    text = re.sub('[\n\t ]+', ' ', text)
+    text = clean_text_zh(text)
     # 在标点符号后添加一个空格
     text = re.sub('([,.!?;])', r'\1 $#!', text)
     # 分隔句子并去除前后空格
@@ -191,4 +429,112 @@ def merge_short_sentences_zh(sens):
             sens_out.pop(-1)
     except:
         pass
-    return sens_out
\ No newline at end of file
+    return sens_out
+
+class StreamingSentenceSplitter:
+    """Incremental sentence splitter for text that arrives in pieces (e.g. LLM token streams).
+
+    A sentence is emitted only once its terminal punctuation is confirmed by the
+    following text, so `push` never cuts inside "3.14" or after "Mr.".
+    Sentences shorter than `min_len` (words for EN, characters otherwise) are
+    merged with the next one, like `merge_short_sentences_*` do. Emitted sentences
+    go through `clean_sentence`, so the model sees the same text as with `split_sentence`.
+
+    Example:
+        splitter = StreamingSentenceSplitter('EN')
+        for delta in token_stream:
+            for sentence in splitter.push(delta):
+                ...
+        for sentence in splitter.close():
+            ...
+    """
+    _boundary_re = re.compile(r'[。！？；]+[”’」』）)]*(?=\s*\S)|[.!?;]+["\'”’)\]]*(?=\s+\S)')
+
+    def __init__(self, language_str='EN', min_len=3):
+        self.language_str = language_str
+        self.min_len = min_len
+        self._buffer = ''
+
+    def _length(self, sentence):
+        if self.language_str in ['EN']:
+            return len(sentence.split())
+        return len(re.sub(r'\s+', '', sentence))
+
+    def push(self, delta):
+        """Append a text delta and return the sentences it completed."""
+        self._buffer += delta
+        sentences = []
+        start = 0
+        for m in self._boundary_re.finditer(self._buffer):
+            sentence = self._buffer[start:m.end()].strip()
+            if _is_abbreviation(self._buffer, m.end()) or self._length(sentence) < self.min_len:
+                continue
+            sentences.append(clean_sentence(sentence, self.language_str))
+            start = m.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def close(self):
+        """Flush whatever is left in the buffer as the final sentence."""
+        sentence = clean_sentence(self._buffer, self.language_str)
+        self._buffer = ''
+        return [sentence] if len(sentence) > 0 else []
+
+
+def stream_sentences(text_stream, language_str='EN'):
+    """Sentences of an iterable of text deltas, as soon as each one is complete."""
+    splitter = StreamingSentenceSplitter(language_str=language_str)
+    for delta in text_stream:
+        for sentence in splitter.push(delta):
+            yield sentence
+    for sentence in splitter.close():
+        yield sentence
+
+
+def pipelined_stages(items, produce, consume, max_in_flight=2):
+    """Two-stage pipeline: `produce` runs on a background thread, `consume` on the caller's.
+
+    Yields consume(produce(item)) for every item, in order, while the producer is
+    already working on the following items. At most `max_in_flight` produced results
+    wait in the queue, so the producer never runs far ahead. Exceptions from either
+    stage are raised in the caller.
+
+    Closing the generator early returns right away: the producer checks for it
+    before every `produce` call and exits as soon as its current call (or the wait on
+    `items`) finishes. It is a daemon thread, so it never blocks interpreter exit.
+    """
+    results = queue.Queue(maxsize=max_in_flight)
+    stop = threading.Event()
+    done = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in items:
+                if stop.is_set() or not put((produce(item), None)):
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        put((done, None))
+
+    producer = threading.Thread(target=run, daemon=True)
+    producer.start()
+    try:
+        while True:
+            value, error = results.get()
+            if error is not None:
+                raise error
+            if value is done:
+                break
+            yield consume(value)
+    finally:
+        stop.set()
@@ -0,0 +1,126 @@
+"""Bulk watermark detection over files or directories, with results written as JSONL.
+
+    python -m openvoice.watermark_scan --ckpt_converter checkpoints_v2/converter \
+        --inputs outputs/ extra.wav --output scan.jsonl --message @MyShell
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a')
+
+
+def iter_audio_files(inputs):
+    """Yield audio file paths from a mix of files and directories (walked recursively)."""
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for fname in sorted(files):
+                    if fname.lower().endswith(AUDIO_EXTENSIONS):
+                        yield os.path.join(root, fname)
+        else:
+            yield path
+
+
+def _load(path, sampling_rate):
+    import librosa
+    try:
+        audio, _ = librosa.load(path, sr=sampling_rate)
+        return path, audio, None
+    except Exception as e:
+        return path, None, e
+
+
+def scan_watermarks(vc_model, inputs, n_repeat=2, message=None, output_path=None,
+                    num_workers=4, batch_files=16):
+    """Detect watermarks in many files.
+
+    Files are decoded on a thread pool (at most 2 * num_workers decoded files are kept
+    in flight) and groups of `batch_files` clips go through one batched decode.
+    One JSON line per file is written to `output_path` (stdout if None).
+
+    Returns:
+        dict: throughput stats (files, failed, audio_seconds, elapsed, files_per_second,
+        realtime_factor), also written to stderr.
+    """
+    sampling_rate = vc_model.hps.data.sampling_rate
+    out = open(output_path, 'w', encoding='utf-8') if output_path is not None else sys.stdout
+    stats = {'files': 0, 'failed': 0, 'audio_seconds': 0.}
+    start = time.time()
+
+    def flush(batch):
+        messages = vc_model.detect_watermark_batch([audio for _, audio in batch], n_repeat)
+        for (path, audio), decoded in zip(batch, messages):
+            record = {'path': path, 'message': decoded, 'duration': len(audio) / sampling_rate}
+            if message is not None:
+                record['match'] = decoded == message
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            stats['audio_seconds'] += record['duration']
+
+    try:
+        with ThreadPoolExecutor(num_workers) as pool:
+            pending = deque()
+            batch = []
+            paths = iter_audio_files(inputs)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < 2 * num_workers:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                    else:
+                        pending.append(pool.submit(_load, path, sampling_rate))
+                if len(pending) == 0:
+                    break
+                batch = _collect(pending.popleft(), batch, stats, out)
+                if len(batch) >= batch_files:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+    finally:
+        if output_path is not None:
+            out.close()
+
+    elapsed = time.time() - start
+    stats['elapsed'] = elapsed
+    stats['files_per_second'] = stats['files'] / elapsed if elapsed > 0 else 0.
+    stats['realtime_factor'] = stats['audio_seconds'] / elapsed if elapsed > 0 else 0.
+    print(json.dumps(stats), file=sys.stderr)
+    return stats
+
+
+def _collect(future, batch, stats, out):
+    path, audio, error = future.result()
+    stats['files'] += 1
+    if error is not None:
+        stats['failed'] += 1
+        out.write(json.dumps({'path': path, 'error': repr(error)}, ensure_ascii=False) + '\n')
+        return batch
+    batch.append((path, audio))
+    return batch
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ckpt_converter', type=str, default='checkpoints_v2/converter')
+    parser.add_argument('--inputs', type=str, nargs='+', required=True, help="audio files and/or directories")
+    parser.add_argument('--output', type=str, default=None, help="JSONL output path, stdout if omitted")
+    parser.add_argument('--message', type=str, default=None, help="expected message, adds a `match` field")
+    parser.add_argument('--n_repeat', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch_files', type=int, default=16)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    from openvoice.api import ToneColorConverter
+    tone_color_converter = ToneColorConverter(f'{args.ckpt_converter}/config.json', device=args.device)
+    tone_color_converter.load_ckpt(f'{args.ckpt_converter}/checkpoint.pth')
+    scan_watermarks(tone_color_converter, args.inputs, n_repeat=args.n_repeat, message=args.message,
+                    output_path=args.output, num_workers=args.workers, batch_files=args.batch_files)
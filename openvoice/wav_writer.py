@@ -0,0 +1,105 @@
+import struct
+import numpy as np
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+_subtypes = {
+    # subtype: (format tag, numpy dtype)
+    'PCM_16': (WAVE_FORMAT_PCM, np.dtype('<i2')),
+    'FLOAT': (WAVE_FORMAT_IEEE_FLOAT, np.dtype('<f4')),
+}
+
+
+class WavWriter(object):
+    """Streaming WAV sink: the header is written once, chunks are appended as they
+    are produced and the RIFF/data lengths are patched on `close`.
+
+    Subtypes follow soundfile naming; 'PCM_16' (the soundfile.write default for WAV)
+    or 'FLOAT'. Float input in [-1, 1] is scaled for PCM_16.
+
+    Example:
+        with WavWriter(output_path, sampling_rate) as writer:
+            for audio in chunks:
+                writer.write(audio)
+    """
+
+    def __init__(self, path, sampling_rate, subtype='PCM_16', channels=1):
+        assert subtype in _subtypes, f"unsupported subtype {subtype}, expected one of {list(_subtypes)}"
+        self.path = path
+        self.sampling_rate = sampling_rate
+        self.subtype = subtype
+        self.channels = channels
+        self.format_tag, self.dtype = _subtypes[subtype]
+        self.n_frames = 0
+        self._file = open(path, 'wb+')
+        self._file.write(self._header(0))
+
+    @property
+    def frame_size(self):
+        return self.dtype.itemsize * self.channels
+
+    def _header(self, n_frames):
+        data_size = n_frames * self.frame_size
+        assert data_size < 2 ** 32 - 64, "WAV data chunk exceeds the 4GB RIFF limit"
+        byte_rate = self.sampling_rate * self.frame_size
+        bits = self.dtype.itemsize * 8
+        if self.format_tag == WAVE_FORMAT_PCM:
+            fmt = struct.pack('<4sIHHIIHH', b'fmt ', 16, self.format_tag, self.channels,
+                              self.sampling_rate, byte_rate, self.frame_size, bits)
+        else:
+            # non-PCM formats carry cbSize and a fact chunk with the frame count
+            fmt = struct.pack('<4sIHHIIHHH', b'fmt ', 18, self.format_tag, self.channels,
+                              self.sampling_rate, byte_rate, self.frame_size, bits, 0)
+            fmt += struct.pack('<4sII', b'fact', 4, n_frames)
+        data = struct.pack('<4sI', b'data', data_size)
+        riff = struct.pack('<4sI4s', b'RIFF', 4 + len(fmt) + len(data) + data_size, b'WAVE')
+        return riff + fmt + data
+
+    @property
+    def header_size(self):
+        return len(self._header(0))
+
+    def _to_samples(self, chunk):
+        chunk = np.asarray(chunk)
+        if chunk.dtype == self.dtype:
+            return chunk
+        if self.format_tag == WAVE_FORMAT_PCM and chunk.dtype.kind == 'f':
+            # round to nearest; astype alone truncates toward zero
+            chunk = np.round(np.clip(chunk, -1., 1.) * 32767)
+        return chunk.astype(self.dtype)
+
+    def write(self, chunk):
+        """Append a chunk of shape [n] (mono) or [n, channels]."""
+        samples = self._to_samples(chunk).reshape(-1, self.channels)
+        self._file.write(samples.tobytes())
+        self.n_frames += samples.shape[0]
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.seek(0)
+        self._file.write(self._header(self.n_frames))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def memmap(cls, path, sampling_rate, n_frames, subtype='PCM_16', channels=1):
+        """Preallocate a WAV file of `n_frames` and return a writable memmap over its samples.
+
+        The returned array has the file's sample dtype (int16 for PCM_16, float32 for
+        FLOAT) and shape [n_frames] (or [n_frames, channels]); flush it when done.
+        """
+        writer = cls(path, sampling_rate, subtype=subtype, channels=channels)
+        writer.n_frames = n_frames
+        offset = writer.header_size
+        writer._file.truncate(offset + n_frames * writer.frame_size)
+        writer.close()
+        shape = (n_frames,) if channels == 1 else (n_frames, channels)
+        return np.memmap(path, dtype=writer.dtype, mode='r+', offset=offset, shape=shape)
@@ -11,6 +11,8 @@ from melo.api import TTS
 
 from openvoice import se_extractor
 from openvoice.api import ToneColorConverter
+from openvoice.se_store import SpeakerEmbeddingStore, nearest_base_speakers
+from openvoice.pipeline import OpenVoicePipeline
 
 
 SUPPORTED_LANGUAGES = ["EN_NEWEST", "EN", "ES", "FR", "ZH", "JP", "KR"]
@@ -37,10 +39,15 @@ class Predictor(BasePredictor):
         ckpt_converter = f"{MODEL_CACHE}/checkpoints_v2/converter"
         self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
         self.tone_color_converter = ToneColorConverter(
-            f"{ckpt_converter}/config.json", device=self.device
+            f"{ckpt_converter}/config.json", device=self.device, deferred_init=True
         )
         self.tone_color_converter.load_ckpt(f"{ckpt_converter}/checkpoint.pth")
 
+        base_speakers = f"{MODEL_CACHE}/checkpoints_v2/base_speakers"
+        # kept in memory: concurrent workers must not share a file under checkpoints
+        self.base_se_store = SpeakerEmbeddingStore()
+        self.base_se_store.import_se_files(f"{base_speakers}/ses/*.pth")
+
     def predict(
         self,
         audio: Path = Input(description="Input reference audio"),
@@ -67,34 +74,38 @@ class Predictor(BasePredictor):
             str(audio),
             self.tone_color_converter,
             target_dir=f"{target_dir}/processed",
-            vad=False,
+            segmentation="silero",
         )
 
         model = TTS(language=language, device=self.device)
         speaker_ids = model.hps.data.spk2id
 
-        src_path = f"{target_dir}/tmp.wav"
         out_path = "/tmp/out.wav"
 
-        for speaker_key in speaker_ids.keys():
-            speaker_id = speaker_ids[speaker_key]
-            speaker_key = speaker_key.lower().replace("_", "-")
-
-            source_se = torch.load(
-                f"{MODEL_CACHE}/checkpoints_v2/base_speakers/ses/{speaker_key}.pth",
-                map_location=self.device,
-            )
-            model.tts_to_file(text, speaker_id, src_path, speed=speed)
-
-            # Run the tone color converter
-            encode_message = "@MyShell"
-            self.tone_color_converter.convert(
-                audio_src_path=src_path,
-                src_se=source_se,
-                tgt_se=target_se,
-                output_path=out_path,
-                message=encode_message,
+        # synthesize only with the base speaker closest to the reference voice
+        nearest = nearest_base_speakers(self.base_se_store, target_se, speaker_ids, k=1)
+        if len(nearest) == 0:
+            raise ValueError(
+                f"no base speaker embedding in {MODEL_CACHE}/checkpoints_v2/base_speakers/ses "
+                f"for the {language} speakers {list(speaker_ids)}"
             )
+        speaker_key, speaker_id, similarity = nearest[0]
+        print(f"base speaker: {speaker_key} (similarity {similarity:.3f})")
+        source_se = self.base_se_store.get_se(
+            speaker_key.lower().replace("_", "-"), self.device
+        )
+
+        # Run the base TTS and the tone color converter without a temporary file
+        encode_message = "@MyShell"
+        pipeline = OpenVoicePipeline(
+            model,
+            self.tone_color_converter,
+            source_se,
+            target_se,
+            speaker=speaker_id,
+            message=encode_message,
+        )
+        pipeline.run(text, speed=speed, output_path=out_path)
 
         return Path(out_path)
 
@@ -2,6 +2,7 @@ import os
 import torch
 from openvoice import se_extractor
 from openvoice.api import ToneColorConverter
+from openvoice.pipeline import OpenVoicePipeline
 import os
 import os
 
@@ -60,8 +61,6 @@ texts = {
 }
 
 
-src_path = f"{output_dir}/tmp.wav"
-
 # Speed is adjustable
 speed = 1.0
 
@@ -76,15 +75,16 @@ for language, text in texts.items():
         source_se = torch.load(
             f"checkpoints_v2/base_speakers/ses/{speaker_key}.pth", map_location=device
         )
-        model.tts_to_file(text, speaker_id, src_path, speed=speed)
         save_path = f"{output_dir}/output_v2_{speaker_key}.wav"
 
-        # Run the tone color converter
+        # Run the base TTS and the tone color converter without a temporary file
         encode_message = "@MyShell"
-        tone_color_converter.convert(
-            audio_src_path=src_path,
-            src_se=source_se,
-            tgt_se=target_se,
-            output_path=save_path,
+        pipeline = OpenVoicePipeline(
+            model,
+            tone_color_converter,
+            source_se,
+            target_se,
+            speaker=speaker_id,
             message=encode_message,
         )
+        pipeline.run(text, speed=speed, output_path=save_path)
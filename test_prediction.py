@@ -126,20 +126,24 @@ def generate_voice(
     return save_path
 
 
-def combine_audio_files(audio_paths, output_path):
+def combine_audio_files(audio_paths, output_path, chunk_frames=65536):
     import wave
 
-    data = []
+    # copy frames in fixed-size chunks so the inputs are never held in memory
+    output = None
     for audio_path in audio_paths:
         w = wave.open(audio_path, "rb")
-        data.append([w.getparams(), w.readframes(w.getnframes())])
+        if output is None:
+            output = wave.open(output_path, "wb")
+            output.setparams(w.getparams())
+        while True:
+            frames = w.readframes(chunk_frames)
+            if not frames:
+                break
+            output.writeframes(frames)
         w.close()
-
-    output = wave.open(output_path, "wb")
-    output.setparams(data[0][0])
-    for i in range(len(data)):
-        output.writeframes(data[i][1])
-    output.close()
+    if output is not None:
+        output.close()
 
 
 if __name__ == "__main__":
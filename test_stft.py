@@ -0,0 +1,51 @@
+import torch
+from openvoice.mel_processing import spectrogram_torch, spectrogram_torch_conv, ConvSpectrogram
+
+# (n_fft, hop_size, win_size): the converter's config, and a window shorter than n_fft
+CONFIGS = [(1024, 256, 1024), (1024, 256, 800), (512, 128, 400)]
+ATOL = 1e-4
+
+
+def max_diff(a, b):
+    return (a - b).abs().max().item()
+
+
+def test_conv_matches_stft():
+    torch.manual_seed(0)
+    y = torch.rand(2, 22050) * 2 - 1
+    for n_fft, hop_size, win_size in CONFIGS:
+        ref = spectrogram_torch(y, n_fft, 22050, hop_size, win_size)
+        conv = spectrogram_torch_conv(y, n_fft, 22050, hop_size, win_size)
+        module = ConvSpectrogram(n_fft, hop_size, win_size)(y)
+        print(f"n_fft={n_fft} hop={hop_size} win={win_size}: "
+              f"conv {max_diff(ref, conv):.2e}, module {max_diff(ref, module):.2e}")
+        assert ref.shape == conv.shape == module.shape
+        assert torch.allclose(ref, conv, atol=ATOL)
+        assert torch.allclose(ref, module, atol=ATOL)
+
+
+def test_lengths_masking():
+    torch.manual_seed(0)
+    lengths = torch.tensor([22050, 15000, 9001])
+    y = torch.zeros(3, 22050)
+    for i, length in enumerate(lengths.tolist()):
+        y[i, :length] = torch.rand(length) * 2 - 1
+    for n_fft, hop_size, win_size in CONFIGS:
+        ref, ref_lengths = spectrogram_torch(y, n_fft, 22050, hop_size, win_size, lengths=lengths)
+        conv, conv_lengths = spectrogram_torch_conv(y, n_fft, 22050, hop_size, win_size, lengths=lengths)
+        assert torch.equal(ref_lengths, conv_lengths)
+        assert torch.allclose(ref, conv, atol=ATOL)
+        for i, length in enumerate(lengths.tolist()):
+            n_frames = ref_lengths[i].item()
+            # valid frames match the unbatched spectrogram, the rest are zero
+            single = spectrogram_torch(y[i:i + 1, :length], n_fft, 22050, hop_size, win_size)
+            assert single.size(-1) == n_frames
+            assert torch.allclose(conv[i:i + 1, :, :n_frames], single, atol=ATOL)
+            assert torch.all(conv[i, :, n_frames:] == 0)
+        print(f"n_fft={n_fft} hop={hop_size} win={win_size}: lengths {ref_lengths.tolist()} ok")
+
+
+if __name__ == "__main__":
+    test_conv_matches_stft()
+    test_lengths_masking()
+    print("conv spectrogram matches torch.stft")